@@ -0,0 +1,222 @@
+"""Benchmark of confsearch module on a panel of molecules of growing size and
+flexibility. Each molecule is benchmarked in a fresh process with seeded
+conformers embedding, so number of conformers retained is reproducible.
+Wall time, peak memory and number of conformers retained is measured for
+`find_lowest_energy_conformer`, `energy_sieve` and `rms_sieve`, as well as
+for `rms_matrix` of conformers embedded without pruning, which exposes cost
+of symmetry-aware RMS for highly symmetric molecules.
+
+Run `python benchmarks/bench_confsearch.py --save` to store results as
+a baseline and `python benchmarks/bench_confsearch.py` later to compare new
+results with it; exit code is 1 if regression is detected. Baseline is
+specific to the machine it was created on. zeetoo package must be
+importable (installed or in PYTHONPATH)."""
+import argparse
+import json
+import multiprocessing
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+from rdkit import Chem
+from rdkit.Chem import AllChem
+
+from zeetoo import confsearch
+
+
+PANEL = {  # from small rigid to large flexible
+    'benzene': 'c1ccccc1',
+    'caffeine': 'Cn1cnc2c1c(=O)n(C)c(=O)n2C',
+    'ibuprofen': 'CC(C)Cc1ccc(cc1)C(C)C(=O)O',
+    # highly symmetric, many equivalent orderings of atoms in RMS
+    'tri-tBu-benzene': 'CC(C)(C)c1cc(cc(c1)C(C)(C)C)C(C)(C)C',
+    'tri-CF3-benzene': 'FC(F)(F)c1cc(cc(c1)C(F)(F)F)C(F)(F)F',
+    'dodecanol': 'CCCCCCCCCCCCO',
+    'macrolactone': 'O=C1CCCCCCCCCCCCCCO1',
+    'tetrapeptide': 'C[C@@H](C(=O)NCC(=O)N[C@@H](CO)C(=O)N[C@@H]'
+                    '(Cc1ccccc1)C(=O)O)N',
+}
+STAGES = (
+    'find_lowest_energy_conformer', 'energy_sieve', 'rms_sieve', 'rms_matrix'
+)
+BASELINE = Path(__file__).resolve().with_name('confsearch_baseline.json')
+
+
+def get_args(argv=None):
+    prs = argparse.ArgumentParser(
+        description='Benchmark confsearch module and compare results with '
+                    'stored baseline.'
+    )
+    prs.add_argument(
+        '-m', '--molecules', nargs='+', choices=PANEL, default=list(PANEL),
+        help='Molecules to benchmark, all by default.'
+    )
+    prs.add_argument(
+        '-n', '--num_confs', type=int, default=100,
+        help='Number of conformers to generate, defaults to 100.'
+    )
+    prs.add_argument(
+        '-r', '--repeat', type=int, default=3,
+        help='Number of repetitions, best time is reported. Defaults to 3.'
+    )
+    prs.add_argument(
+        '--seed', type=int, default=42,
+        help='Seed of random number generator, defaults to 42.'
+    )
+    prs.add_argument(
+        '-b', '--baseline', type=Path, default=BASELINE,
+        help=f'Baseline file, defaults to {BASELINE.name} next to this script.'
+    )
+    prs.add_argument(
+        '-s', '--save', action='store_true',
+        help='Save results as new baseline instead of comparing with it.'
+    )
+    prs.add_argument(
+        '-t', '--tolerance', type=float, default=0.25,
+        help='Allowed relative increase of time and memory usage before it is '
+             'reported as regression, defaults to 0.25.'
+    )
+    return prs.parse_args(argv)
+
+
+def _peak_rss():
+    """Peak resident set size of current process in kB (0 if unknown)."""
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def run_case(smiles, num_confs, seed, rms_tresh=0.5, energy_window=5):
+    """Runs all benchmarked stages for molecule given as SMILES. Should be
+    called in a fresh process, as peak memory is measured for whole process.
+    Returns a dict of {stage: {measure: value}}."""
+    molecule = Chem.AddHs(Chem.MolFromSmiles(smiles))
+    AllChem.EmbedMolecule(molecule, randomSeed=seed)
+    Chem.AssignStereochemistryFrom3D(molecule)
+    # all conformers embedded, regardless of their similarity, so RMS matrix
+    # is measured on `num_confs` conformers even for rigid molecules
+    unpruned = Chem.Mol(molecule)
+    AllChem.EmbedMultipleConfs(unpruned, num_confs, randomSeed=seed)
+    energies = {}
+    calls = {
+        'find_lowest_energy_conformer': lambda m: confsearch.
+        find_lowest_energy_conformer(
+            m, num_confs, rms_tresh, 10, {}, [], seed=seed
+        ),
+        'energy_sieve': lambda m: confsearch.energy_sieve(
+            m, energies, energy_window
+        ),
+        'rms_sieve': lambda m: confsearch.rms_sieve(m, energies, rms_tresh),
+        'rms_matrix': lambda m: confsearch.rms_matrix(unpruned),
+    }
+    measured = {'rms_matrix': unpruned}
+    results = {}
+    tracemalloc.start()
+    for stage in STAGES:
+        rss = _peak_rss()
+        tracemalloc.reset_peak()
+        start = time.perf_counter()
+        result = calls[stage](molecule)
+        elapsed = time.perf_counter() - start
+        if stage == 'find_lowest_energy_conformer':
+            molecule, _, _, found = result
+            energies.update(found)
+        results[stage] = {
+            'time': elapsed,
+            'peak_rss_kb': _peak_rss() - rss,
+            'python_peak_kb': tracemalloc.get_traced_memory()[1] // 1024,
+            'conformers': measured.get(stage, molecule).GetNumConformers(),
+        }
+    tracemalloc.stop()
+    return results
+
+
+def benchmark(molecules, num_confs, seed, repeat):
+    """Runs benchmark for each of `molecules` `repeat` times, each time in
+    a fresh process, and returns best results for each stage."""
+    context = multiprocessing.get_context('spawn')
+    results = {}
+    for name in molecules:
+        runs = []
+        for _ in range(repeat):
+            with ProcessPoolExecutor(1, mp_context=context) as executor:
+                runs.append(executor.submit(
+                    run_case, PANEL[name], num_confs, seed
+                ).result())
+        results[name] = {
+            stage: {
+                measure: min(run[stage][measure] for run in runs)
+                for measure in runs[0][stage]
+            } for stage in STAGES
+        }
+        print(f"{name: <14}", ' '.join(
+            f"{stage}: {result['time']:.3f} s, {result['conformers']} confs;"
+            for stage, result in results[name].items()
+        ))
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Returns list of messages describing regressions of `results`
+    in comparison to `baseline`."""
+    regressions = []
+    for name, stages in results.items():
+        for stage, new in stages.items():
+            old = baseline.get(name, {}).get(stage)
+            if old is None:
+                continue
+            if new['conformers'] != old['conformers']:
+                regressions.append(
+                    f"{name} {stage}: {new['conformers']} conformers "
+                    f"retained, {old['conformers']} expected"
+                )
+            for measure in ('time', 'peak_rss_kb', 'python_peak_kb'):
+                # ignore small absolute values, as they are mostly noise
+                floor = 0.01 if measure == 'time' else 1024
+                limit = max(old[measure] * (1 + tolerance), floor)
+                if new[measure] > limit:
+                    regressions.append(
+                        f"{name} {stage}: {measure} = {new[measure]:.3f}, "
+                        f"baseline = {old[measure]:.3f}"
+                    )
+    return regressions
+
+
+def main(argv=None):
+    args = get_args(argv)
+    params = {'num_confs': args.num_confs, 'seed': args.seed}
+    results = benchmark(args.molecules, args.num_confs, args.seed, args.repeat)
+    if args.save:
+        with args.baseline.open('w') as file:
+            json.dump({'params': params, 'results': results}, file, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+    try:
+        with args.baseline.open() as file:
+            baseline = json.load(file)
+    except FileNotFoundError:
+        print(f"No baseline found at {args.baseline}, run with --save first.")
+        return 1
+    if baseline['params'] != params:
+        print(f"Baseline was created with different parameters: "
+              f"{baseline['params']}")
+        return 1
+    regressions = compare(results, baseline['results'], args.tolerance)
+    for message in regressions:
+        print("REGRESSION:", message)
+    if not regressions:
+        print("No regressions found.")
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+
+    sys.exit(main())
@@ -0,0 +1,478 @@
+import os
+from functools import partial
+
+import pytest
+
+Chem = pytest.importorskip("rdkit.Chem")
+import numpy as np
+from rdkit.Chem import AllChem
+
+from zeetoo import confsearch as cs
+
+
+@pytest.fixture
+def molecule():
+    mol = Chem.AddHs(Chem.MolFromSmiles("CCCCOCC(=O)N"))
+    AllChem.EmbedMolecule(mol, randomSeed=42)
+    return mol
+
+
+@pytest.fixture
+def seeded(monkeypatch):
+    embed = AllChem.EmbedMultipleConfs
+
+    def seeded_embed(*args, **kwargs):
+        return embed(*args, randomSeed=7, **kwargs)
+
+    monkeypatch.setattr(AllChem, "EmbedMultipleConfs", seeded_embed)
+
+
+def test_parallel_minimization_same_as_serial(molecule, seeded):
+    constraints = [("d", 0, 4, False, 2.0, 3.0, 1e5)]
+    serial = cs.find_lowest_energy_conformer(
+        Chem.Mol(molecule), 8, 0.5, 10, {}, constraints, workers=1
+    )
+    parallel = cs.find_lowest_energy_conformer(
+        Chem.Mol(molecule), 8, 0.5, 10, {}, constraints, workers=2
+    )
+    assert serial[1:] == parallel[1:]
+
+
+def test_bulk_engine_falls_back_with_constraints():
+    assert cs.select_engine("bulk", {}, []) == "bulk"
+    assert cs.select_engine("bulk", {0: (0, 0, 0)}, []) == "loop"
+    assert cs.select_engine("bulk", {}, [("p", 0, 0.1, 1e5)]) == "loop"
+
+
+def test_bulk_engine_minimizes_all(molecule, seeded):
+    mol, min_id, min_en, energies = cs.find_lowest_energy_conformer(
+        molecule, 8, 0.5, 10, {}, [], engine="bulk"
+    )
+    assert mol.GetNumConformers() == len(energies)
+    assert energies[min_id] == min_en == min(energies.values())
+
+
+def test_largest_first():
+    blocks = []
+    for smiles in ["CO", "CCCCCC", "CCC"]:
+        mol = Chem.AddHs(Chem.MolFromSmiles(smiles))
+        AllChem.EmbedMolecule(mol, randomSeed=42)
+        blocks.append(Chem.MolToMolBlock(mol))
+    assert cs.largest_first(blocks) == [1, 2, 0]
+
+
+def test_rms_sieve_keeps_lowest_energy_representatives(molecule, seeded):
+    mol, _, _, energies = cs.find_lowest_energy_conformer(
+        molecule, 20, 0.1, 10, {}, []
+    )
+    before = {c.GetId(): c.GetPositions() for c in mol.GetConformers()}
+    all_energies = dict(energies)
+    matrix = cs.rms_matrix(mol)
+    ids = [c.GetId() for c in mol.GetConformers()]
+    threshold = float(np.median(matrix[np.triu_indices(len(ids), 1)]))
+    mol = cs.rms_sieve(mol, energies, threshold)
+    kept = {c.GetId() for c in mol.GetConformers()}
+    assert kept == set(energies)
+    assert min(all_energies, key=all_energies.get) in kept
+    index = {cid: n for n, cid in enumerate(ids)}
+    for cid in ids:
+        closer = [
+            other for other in kept if other != cid
+            and matrix[index[cid], index[other]] <= threshold
+            and all_energies[other] <= all_energies[cid]
+        ]
+        # conformer is discarded only if there is similar kept conformer
+        # of lower energy
+        assert bool(closer) != (cid in kept)
+    assert len(before) > len(kept)
+
+
+def test_kabsch_rms_same_as_rdkit(molecule):
+    AllChem.EmbedMultipleConfs(molecule, 5, randomSeed=7)
+    heavy = [a.GetIdx() for a in molecule.GetAtoms() if a.GetAtomicNum() > 1]
+    coords = np.stack(
+        [c.GetPositions()[heavy] for c in molecule.GetConformers()]
+    )
+    noh = Chem.RemoveHs(molecule)
+    expected = [AllChem.GetConformerRMS(noh, 0, n) for n in range(5)]
+    assert np.allclose(cs.kabsch_rms(coords[0], coords), expected, atol=1e-6)
+
+
+def test_incremental_search_keeps_unique_conformers(molecule, seeded):
+    mol, min_id, min_en, energies = cs.incremental_search(
+        molecule, 60, 0.5, 3, 10, {}, [], batch_size=16
+    )
+    assert mol.GetNumConformers() == len(energies)
+    assert min_en == energies[min_id] == min(energies.values())
+    assert max(energies.values()) <= min_en + 3
+    matrix = cs.rms_matrix(mol)
+    assert (matrix[np.triu_indices(len(energies), 1)] > 0.5).all()
+
+
+def test_incremental_search_stops_early(molecule, seeded):
+    mol, _, _, energies = cs.incremental_search(
+        molecule, 60, 0.1, 100, 10, {}, [], max_unique=3
+    )
+    assert len(energies) == mol.GetNumConformers() == 3
+
+
+def test_incremental_search_saturation(molecule, seeded):
+    stats = {}
+    cs.incremental_search(
+        molecule, 1000, 0.5, 3, 10, {}, [], batch_size=20, saturation=2,
+        stats=stats
+    )
+    assert 2 < stats["batches"] < 50
+
+
+def test_incremental_search_top_k(molecule, seeded):
+    _, _, _, full = cs.incremental_search(
+        Chem.Mol(molecule), 60, 0.5, 100, 10, {}, [], batch_size=16
+    )
+    mol, _, _, energies = cs.incremental_search(
+        Chem.Mol(molecule), 60, 0.5, 100, 10, {}, [], batch_size=16, top_k=3
+    )
+    assert mol.GetNumConformers() == len(energies) == 3
+    assert sorted(energies.values()) == pytest.approx(
+        sorted(full.values())[:3]
+    )
+
+
+def test_cache_roundtrip(molecule, seeded, tmp_path):
+    args = cs.get_args(["-m", "some.mol"])
+    key = cs.cache_key(molecule, args, [])
+    other = cs.get_args(["-d", ".", "-n", "5"])
+    assert key != cs.cache_key(molecule, other, [])
+    assert cs.load_cached(str(tmp_path), key, Chem.Mol(molecule)) is None
+    mol, min_id, min_en, energies = cs.find_lowest_energy_conformer(
+        molecule, 5, 0.5, 10, {}, []
+    )
+    cs.store_cached(str(tmp_path), key, mol, min_id, energies, {})
+    loaded, cid, en, ens, summary = cs.load_cached(
+        str(tmp_path), key, Chem.Mol(molecule)
+    )
+    assert (cid, en, ens, summary) == (min_id, min_en, energies, {})
+    assert [c.GetId() for c in loaded.GetConformers()] == list(energies)
+    cs.evict_cache(str(tmp_path), 0)
+    assert not list(tmp_path.iterdir())
+
+
+def test_resume_from_checkpoint(molecule, seeded, tmp_path, monkeypatch):
+    checkpoint = str(tmp_path / "mol")
+    expected = cs.find_lowest_energy_conformer(
+        Chem.Mol(molecule), 10, 0.1, 10, {}, []
+    )
+    save = cs.save_checkpoint
+    saved = []
+
+    def crashing(*args, **kwargs):
+        if len(saved) == 2:  # after embedding and after first chunk
+            raise RuntimeError("killed")
+        saved.append(args[2])
+        return save(*args, **kwargs)
+
+    monkeypatch.setattr(cs, "save_checkpoint", crashing)
+    with pytest.raises(RuntimeError):
+        cs.find_lowest_energy_conformer(
+            Chem.Mol(molecule), 10, 0.1, 10, {}, [], workers=2,
+            checkpoint=checkpoint, checkpoint_interval=0
+        )
+    assert 0 < len(saved[1]["minimized"]) < 10
+    monkeypatch.setattr(cs, "save_checkpoint", save)
+    monkeypatch.setattr(cs, "_embed", None)  # must not embed again
+    parallel = cs._minimize_parallel
+    calls = []
+
+    def counted(*args, **kwargs):
+        calls.append(1)
+        return parallel(*args, **kwargs)
+
+    monkeypatch.setattr(cs, "_minimize_parallel", counted)
+    resumed = cs.find_lowest_energy_conformer(
+        Chem.Mol(molecule), 10, 0.1, 10, {}, [], workers=2,
+        checkpoint=checkpoint, checkpoint_interval=0
+    )
+    assert resumed[1:] == expected[1:]
+    assert len(calls) == 1  # one process pool for all checkpoints
+
+
+def test_read_molecules_from_gzipped_sdf(tmp_path):
+    import gzip
+    path = tmp_path / "lib.sdf.gz"
+    with gzip.open(path, "wt") as file:
+        writer = Chem.SDWriter(file)
+        for name, smiles in [("first", "CO"), ("", "CCO")]:
+            mol = Chem.MolFromSmiles(smiles)
+            mol.SetProp("_Name", name)
+            writer.write(mol)
+        writer.close()
+    molecules = cs.read_molecules([str(path)])
+    name, stem, block, source = next(molecules)
+    assert (name, stem, source) == ("first", "lib_0", str(path))
+    assert Chem.MolFromMolBlock(block).GetNumAtoms() == 2
+    assert [m[:2] for m in molecules] == [("lib#1", "lib_1")]
+
+
+def test_gzip_needs_single_file():
+    with pytest.raises(SystemExit):
+        cs.get_args(["-m", "some.mol", "-z"])
+    assert cs.get_args(["-m", "some.mol", "-z", "--single_file"]).gzip
+
+
+@pytest.mark.parametrize("suffix", [".sdf", ".sdf.gz"])
+def test_combined_writer_index(tmp_path, suffix):
+    import gzip
+    path = str(tmp_path / ("confs" + suffix))
+    done = []
+    records = {"first": "a\n$$$$\n", "second": "b\n$$$$\nc\n$$$$\n"}
+    with cs.CombinedWriter(path, compress=suffix.endswith(".gz")) as writer:
+        for name, text in records.items():
+            writer.write(
+                name, text, text.count("$$$$"), partial(done.append, name)
+            )
+        assert not done  # still buffered
+        writer.index.flush()
+        assert not os.path.getsize(path + ".index")  # index waits for data
+    assert done == ["first", "second"]
+    assert cs.read_combined(path, "second") == records["second"]
+    opener = gzip.open if suffix.endswith(".gz") else open
+    with opener(path, "rt") as file:
+        assert file.read() == "".join(records.values())
+    # molecule written again after resuming
+    with cs.CombinedWriter(path, compress=suffix.endswith(".gz"),
+                           append=True) as writer:
+        writer.write("second", "d\n$$$$\n", 1)
+    assert cs.read_combined(path, "second") == "d\n$$$$\n"
+
+
+def test_search_statistics(molecule, seeded):
+    stats = {}
+    _, _, _, energies = cs.find_lowest_energy_conformer(
+        molecule, 8, 0.1, 10, {}, [], stats=stats
+    )
+    assert stats["embedded"] == len(energies) + stats["failed"]
+    assert stats["minimization_cycles"] >= stats["embedded"]
+    for stage in ("embedding", "ff_setup", "minimization"):
+        assert stats[stage + "_time"] > 0
+
+
+@pytest.mark.parametrize("force_field", ["MMFF94s", "UFF"])
+def test_force_field_setup_reused(molecule, force_field):
+    AllChem.EmbedMultipleConfs(molecule, 4, randomSeed=7)
+    reference = Chem.Mol(molecule)
+    setup = cs.ForceFieldSetup(molecule, force_field)
+    assert setup.reusable
+    for conf in molecule.GetConformers():
+        energy = setup.minimize(conf, 10)
+        if force_field == "UFF":
+            ff = AllChem.UFFGetMoleculeForceField(
+                reference, confId=conf.GetId()
+            )
+        else:
+            ff = AllChem.MMFFGetMoleculeForceField(
+                reference, AllChem.MMFFGetMoleculeProperties(
+                    reference, mmffVariant=force_field
+                ), confId=conf.GetId()
+            )
+        ff.Initialize()
+        ff.Minimize(maxIts=2000)
+        assert energy == pytest.approx(ff.CalcEnergy())
+        assert np.allclose(
+            conf.GetPositions(),
+            reference.GetConformer(conf.GetId()).GetPositions(), atol=1e-4
+        )
+
+
+def test_force_field_unavailable():
+    molecule = Chem.AddHs(Chem.MolFromSmiles("C[Hg]C"))
+    with pytest.raises(cs.MissingParametersError):
+        cs.ForceFieldSetup(molecule, "MMFF94")
+    assert cs.ForceFieldSetup(molecule, "UFF").reusable
+    AllChem.EmbedMultipleConfs(molecule, 2, randomSeed=1)
+    with pytest.raises(cs.MissingParametersError):
+        cs._minimize_bulk(molecule, 10, "MMFF94")
+    assert None not in cs._minimize_bulk(molecule, 10, "UFF").values()
+
+
+def test_search_molecule_nothing_converged(tmp_path):
+    molecule = Chem.AddHs(Chem.MolFromSmiles("C1" + "C" * 29 + "1"))
+    AllChem.EmbedMolecule(molecule, randomSeed=1)
+    args = cs.get_args(
+        ["-m", "x.mol", "-n", "3", "-c", "1", "-o", str(tmp_path)]
+    )
+    block = Chem.MolToMolBlock(molecule)
+    assert cs.search_molecule("x.mol", "x", block, args, []) is None
+
+
+def test_write_gjf(molecule, tmp_path):
+    AllChem.EmbedMultipleConfs(molecule, 2, randomSeed=7)
+    energies = {0: 1.5, 1: 0.5}
+    cs.write_gjf(
+        str(tmp_path / "gjf"), "mol", molecule, [1, 0], energies, "butyl",
+        "opt b3lyp/6-31g", link="%mem=1GB", chk="chk"
+    )
+    assert sorted(p.name for p in (tmp_path / "gjf").iterdir()) == [
+        "mol000.gjf", "mol001.gjf"
+    ]
+    lines = (tmp_path / "gjf" / "mol000.gjf").read_text().splitlines()
+    assert lines[:7] == [
+        "%chk=chk/mol000.chk", "%mem=1GB", "# opt b3lyp/6-31g", "",
+        "butyl, energy 0.50000000 kcal/mol", "", "0 1"
+    ]
+    first = lines[7].split()
+    assert first[0] == "C"
+    assert np.allclose(
+        [float(v) for v in first[1:]],
+        molecule.GetConformer(1).GetAtomPosition(0), atol=1e-7
+    )
+    assert len(lines) == 7 + molecule.GetNumAtoms() + 2
+
+
+def test_average_linkage():
+    points = np.array([0.0, 0.1, 0.2, 5.0, 5.1, 9.0])
+    matrix = np.abs(points[:, None] - points[None, :])
+    clusters = cs._average_linkage(matrix, 0.5)
+    assert sorted(sorted(c) for c in clusters) == [[0, 1, 2], [3, 4], [5]]
+
+
+def test_boltzmann_weights():
+    weights = cs.boltzmann_weights({0: 1.0, 1: 1.0, 2: 100.0})
+    assert weights[0] == weights[1] == pytest.approx(0.5)
+    assert sum(weights.values()) == pytest.approx(1)
+
+
+@pytest.mark.parametrize("method", cs.CLUSTERING)
+def test_cluster_conformers(molecule, seeded, method):
+    mol, _, _, energies = cs.find_lowest_energy_conformer(
+        molecule, 20, 0.1, 10, {}, []
+    )
+    clusters = cs.cluster_conformers(mol, energies, 1.0, method)
+    assert sorted(cid for c in clusters for cid in c) == sorted(energies)
+    firsts = [energies[c[0]] for c in clusters]
+    assert firsts == sorted(firsts)
+    assert all(energies[c[0]] == min(energies[i] for i in c) for c in clusters)
+    summary = cs.cluster_sieve(mol, energies, clusters)
+    assert sorted(c["id"] for c in summary) == sorted(
+        conf.GetId() for conf in mol.GetConformers()
+    )
+    assert sum(c["size"] for c in summary) == len(energies)
+    assert sum(c["population"] for c in summary) == pytest.approx(1)
+    # representatives are aligned, as after rms_sieve
+    aligned = Chem.Mol(mol)
+    AllChem.AlignMolConformers(aligned)
+    for conf in mol.GetConformers():
+        np.testing.assert_allclose(
+            conf.GetPositions(),
+            aligned.GetConformer(conf.GetId()).GetPositions(), atol=1e-4
+        )
+
+
+def test_rms_matrix_is_symmetry_aware():
+    from rdkit.Chem import rdMolAlign
+    mol = Chem.AddHs(Chem.MolFromSmiles("CC(C)Cc1ccccc1"))
+    AllChem.EmbedMultipleConfs(mol, 6, randomSeed=7)
+    assert len(cs.symmetry_maps(mol)) == 4
+    noh = Chem.RemoveHs(mol)
+    expected = [
+        rdMolAlign.GetBestRMS(noh, noh, prbId=n, refId=0) for n in range(6)
+    ]
+    assert np.allclose(cs.rms_matrix(mol)[0], expected, atol=1e-6)
+    maps = cs.symmetry_maps(mol, 2)
+    assert len(maps) == 2 and (maps[0] == np.arange(maps.shape[1])).all()
+    assert len(cs.symmetry_maps(mol, 1)) == 1
+
+
+def test_torsion_prefilter(molecule):
+    from rdkit.Chem import rdMolTransforms
+    AllChem.EmbedMultipleConfs(molecule, 10, randomSeed=7)
+    heavy = cs.heavy_atoms(molecule)
+    torsions = cs.rotatable_torsions(molecule)
+    assert len(torsions) == 5
+    conf = molecule.GetConformer(0)
+    angles = cs.torsion_angles(conf.GetPositions()[heavy], torsions)
+    expected = [
+        rdMolTransforms.GetDihedralDeg(conf, *(heavy[n] for n in torsion))
+        for torsion in torsions
+    ]
+    assert np.allclose(angles, expected)
+    coords = np.stack(
+        [c.GetPositions()[heavy] for c in molecule.GetConformers()]
+    )
+    maps = np.stack([np.arange(len(heavy)), np.arange(len(heavy))[::-1]])
+    assert np.allclose(
+        cs.torsion_angles(coords, maps[:, torsions]),
+        cs.torsion_angles(coords[:, maps], torsions)
+    )
+    full = cs.rms_matrix(molecule)
+    stats = {}
+    assert np.allclose(cs.rms_matrix(molecule, tolerance=180, stats=stats), full)
+    assert stats == {"rms_pairs": 45, "rms_pairs_skipped": 0}
+    stats = {}
+    filtered = cs.rms_matrix(molecule, tolerance=10, stats=stats)
+    assert stats["rms_pairs_skipped"] > 0
+    computed = np.isfinite(filtered)
+    assert np.allclose(filtered[computed], full[computed])
+
+
+def test_conformer_store(molecule, seeded):
+    mol, _, _, energies = cs.find_lowest_energy_conformer(
+        molecule, 20, 0.1, 10, {}, []
+    )
+    expected = cs.rms_sieve(Chem.Mol(mol), dict(energies), 0.5)
+    store = cs.ConformerStore.from_molecule(mol, energies, np.float32)
+    assert store.positions.shape == (len(energies), mol.GetNumAtoms(), 3)
+    assert len(store) == len(energies)
+    store.rms_sieve(0.5)
+    store.top_k_sieve(3)
+    kept = store.kept_ids
+    assert sorted(kept) == sorted(sorted(
+        (c.GetId() for c in expected.GetConformers()), key=energies.get
+    )[:3])
+    out = store.to_molecule(Chem.Mol(mol))
+    assert [c.GetId() for c in out.GetConformers()] == sorted(kept)
+    for conf in out.GetConformers():
+        original = mol.GetConformer(conf.GetId()).GetPositions()
+        assert np.allclose(conf.GetPositions(), original, atol=1e-5)
+
+
+def test_store_rms_sieve_same_as_matrix(molecule, seeded):
+    mol, _, _, energies = cs.find_lowest_energy_conformer(
+        molecule, 30, 0.1, 10, {}, []
+    )
+    for tolerance in (None, 60):
+        store = cs.ConformerStore.from_molecule(mol, energies)
+        indices = store._candidates()
+        matrix = store.rms_matrix(indices, tolerance)
+        keep = np.ones(len(indices), dtype=bool)
+        for n in range(len(indices)):
+            if keep[n]:
+                keep[n+1:] &= matrix[n, n+1:] > 0.5
+        stats = {}
+        discarded = store.rms_sieve(0.5, tolerance, stats)
+        assert sorted(discarded) == sorted(store.ids[indices[~keep]])
+        # only rows of kept conformers are calculated
+        assert stats["rms_pairs"] < len(indices) * (len(indices) - 1) // 2
+
+
+def test_seed_gives_identical_results(molecule):
+    first = cs.find_lowest_energy_conformer(
+        Chem.Mol(molecule), 8, 0.5, 10, {}, [], seed=11
+    )
+    second = cs.find_lowest_energy_conformer(
+        Chem.Mol(molecule), 8, 0.5, 10, {}, [], workers=2, seed=11
+    )
+    assert first[1:] == second[1:]
+    for conf in first[0].GetConformers():
+        assert (
+            conf.GetPositions()
+            == second[0].GetConformer(conf.GetId()).GetPositions()
+        ).all()
+    stats = {}
+    incremental = [
+        cs.incremental_search(
+            Chem.Mol(molecule), 30, 0.5, 5, 10, {}, [], batch_size=10,
+            seed=11, stats=stats
+        ) for _ in range(2)
+    ]
+    assert incremental[0][1:] == incremental[1][1:]
+    assert len(set(stats["seeds"])) == 3
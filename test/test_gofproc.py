@@ -0,0 +1,162 @@
+import pytest
+
+pytest.importorskip("openpyxl")
+from zeetoo import gofproc
+
+THERMOCHEMISTRY = """\
+ Zero-point correction=                           0.123456 (Hartree/Particle)
+ Thermal correction to Energy=                    0.130000
+ Thermal correction to Enthalpy=                  0.131000
+ Thermal correction to Gibbs Free Energy=         0.090000
+ Sum of electronic and zero-point Energies=           -400.876544
+ Sum of electronic and thermal Energies=              -400.870000
+ Sum of electronic and thermal Enthalpies=            -400.869000
+ Sum of electronic and thermal Free Energies=          -400.910000
+"""
+VALUES = [
+    "0.123456", "0.130000", "0.131000", "0.090000",
+    "-400.876544", "-400.870000", "-400.869000", "-400.910000",
+]
+
+
+def make_log(imag=1, thermochemistry=True, newline="\n"):
+    lines = [" SCF Done:  E(RB3LYP) =  -400.123456789"] * 500
+    lines += [" Low frequencies ---  -50.3   20.1   30.2"] * 2
+    if imag:
+        lines.append(
+            f" ******    {imag} imaginary frequencies (negative Signs) ******"
+        )
+    lines += [" Harmonic frequencies (cm**-1)"] + [" 0.01" * 10] * 500
+    if thermochemistry:
+        lines += THERMOCHEMISTRY.splitlines()
+    lines.append(" Normal termination of Gaussian 16")
+    return newline.join(lines) + newline
+
+
+@pytest.mark.parametrize("imag", [0, 2])
+@pytest.mark.parametrize("newline", ["\n", "\r\n"])
+def test_get_data_reads_from_end(tmp_path, imag, newline):
+    path = tmp_path / "job.log"
+    path.write_bytes(make_log(imag, newline=newline).encode())
+    expected = [*VALUES, str(imag) if imag else 0]
+    assert gofproc.get_data(path, chunk_size=1000) == expected
+
+
+def test_get_data_not_converged(tmp_path):
+    path = tmp_path / "job.log"
+    path.write_text(make_log(thermochemistry=False))
+    assert gofproc.get_data(path, chunk_size=1000) == []
+
+
+@pytest.mark.parametrize("jobs", [1, 3])
+def test_parse_files_keeps_order(tmp_path, jobs):
+    paths = []
+    for num, imag in enumerate([2, 0, 1, 3]):
+        path = tmp_path / f"{num}.log"
+        path.write_text(make_log(imag))
+        paths.append(path)
+    files = [(path.name, path) for path in reversed(paths)]
+    parsed = list(gofproc.parse_files(files, jobs))
+    assert [name for name, *_ in parsed] == ["3.log", "2.log", "1.log", "0.log"]
+    assert [data[-1] for _, data, _ in parsed] == ["3", "1", 0, "2"]
+
+
+def test_cache_skips_unchanged_files(tmp_path, monkeypatch):
+    path = tmp_path / "job.log"
+    path.write_text(make_log(1))
+    cache_file = tmp_path / "cache.json"
+    cache = gofproc.load_cache(cache_file)
+    files = [("job.log", path)]
+    first = list(gofproc.parse_files(files, cache=cache, progress=True))
+    gofproc.save_cache(cache_file, cache)
+    # must not parse again
+    monkeypatch.setattr(gofproc, "get_data", None)
+    monkeypatch.setattr(gofproc, "get_progress", None)
+    cache = gofproc.load_cache(cache_file)
+    assert list(gofproc.parse_files(files, cache=cache, progress=True)) == first
+    monkeypatch.undo()
+    path.write_text(make_log(2))
+    parsed = list(gofproc.parse_files([("job.log", path)], cache=cache))
+    assert parsed[0][1][-1] == "2"
+
+
+def test_cache_drops_unseen_files(tmp_path):
+    paths = [tmp_path / "a.log", tmp_path / "b.log"]
+    for path in paths:
+        path.write_text(make_log(1))
+    cache_file = tmp_path / "cache.json"
+    cache = {}
+    list(gofproc.parse_files([(p.name, p) for p in paths], cache=cache))
+    gofproc.save_cache(cache_file, cache)
+    paths[1].unlink()
+    cache, seen = gofproc.load_cache(cache_file), set()
+    assert len(cache) == 2
+    list(gofproc.parse_files([("a.log", paths[0])], cache=cache, seen=seen))
+    gofproc.save_cache(cache_file, cache, seen)
+    assert list(gofproc.load_cache(cache_file)) == [str(paths[0].resolve())]
+
+
+@pytest.mark.parametrize("follow", [False, True])
+def test_find_files_recursive(tmp_path, follow):
+    for name in ["root/b/c1/job.log", "root/b/c2/job.out", "root/a.log",
+                 "root/b/skip/x.log", "root/b/c1/job.chk",
+                 "root/b/c1/old.log", "outside/c3/job.log"]:
+        path = tmp_path / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text("")
+    root = tmp_path / "root"
+    (root / "z").symlink_to(tmp_path / "outside")
+    (root / "b" / "loop").symlink_to(root)
+    found = gofproc.find_files(
+        [root], exclude=["skip", "old.*"], recursive=True,
+        follow_symlinks=follow
+    )
+    expected = ["a.log", "b/c1/job.log", "b/c2/job.out"]
+    if follow:
+        expected.append("z/c3/job.log")
+    assert [name for name, _ in found] == expected
+    assert [name for name, _ in gofproc.find_files([root])] == ["a.log"]
+
+
+OPTIMIZATION_STEP = """\
+ SCF Done:  E(RB3LYP) =  {energy}     A.U. after   10 cycles
+                          Input orientation:
+ ---------------------------------------------------------------------
+ Center     Atomic      Atomic             Coordinates (Angstroms)
+ Number     Number       Type             X           Y           Z
+ ---------------------------------------------------------------------
+      1          8           0        0.000000    0.000000    {z:.6f}
+      2          1           0        0.000000    0.760000   -0.470000
+      3          1           0        0.000000   -0.760000   -0.470000
+ ---------------------------------------------------------------------
+         Item               Value     Threshold  Converged?
+ Maximum Force            0.000300     0.000450     YES
+ RMS     Force            0.000200     0.000300     YES
+ Maximum Displacement     {disp:.6f}     0.001800     {met}
+ RMS     Displacement     0.000100     0.001200     YES
+"""
+
+
+def test_get_progress(tmp_path):
+    path = tmp_path / "job.log"
+    text = " Entering Link 1 = C:\\G16W\\l1.exe PID=      1234.\n"
+    for energy, z, disp in [(-76.1, 0.2, 0.01), (-76.3, 0.1, 0.001)]:
+        met = "YES" if disp < 0.0018 else "NO"
+        text += OPTIMIZATION_STEP.format(energy=energy, z=z, disp=disp, met=met)
+    path.write_text(text)
+    progress = gofproc.get_progress(path)
+    assert progress["scf"] == -76.3
+    assert [s["energy"] for s in progress["steps"]] == [-76.1, -76.3]
+    assert [s["converged"] for s in progress["steps"]] == [False, True]
+    assert progress["steps"][0]["criteria"]["Maximum Displacement"] == [
+        0.01, 0.0018, False
+    ]
+    assert progress["geometry"][0] == [8, 0.0, 0.0, 0.1]
+    assert len(progress["geometry"]) == 3
+    assert not progress["normal_termination"]
+    path.write_text(text + " Normal termination of Gaussian 16\n")
+    assert gofproc.get_progress(path)["normal_termination"]
+    path.write_text(make_log())
+    progress = gofproc.get_progress(path)
+    assert progress["scf"] == -400.123456789
+    assert progress["steps"] == [] and progress["geometry"] is None
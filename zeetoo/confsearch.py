@@ -1,10 +1,46 @@
 import argparse
+import gzip
+import hashlib
+import heapq
+import io
+import json
 import os
+import pathlib
+import shutil
+import time
+import cProfile
 import logging as lgg
-from math import floor, sqrt
+from contextlib import ExitStack, contextmanager
+from functools import partial
+from concurrent.futures import (
+    FIRST_COMPLETED, ProcessPoolExecutor, as_completed, wait
+)
+from math import ceil
+import numpy as np
 import rdkit
 from rdkit import Chem
 from rdkit.Chem import AllChem
+from rdkit.ML.Cluster import Butina
+
+from .sdf_to_gjf import parse_link_zero, save_molecule
+
+
+ENGINES = ('loop', 'bulk')
+FORCE_FIELDS = ('MMFF94', 'MMFF94s', 'UFF')
+CLUSTERING = ('butina', 'average')
+GAS_CONSTANT = 1.987204259e-3  # kcal/(mol*K)
+CACHED_PARAMS = (
+    'num_confs', 'rms_tresh', 'energy_window', 'max_cycles', 'engine',
+    'incremental', 'max_unique', 'batch_size', 'saturation', 'force_field',
+    'top_k', 'cluster', 'temperature', 'torsion_tolerance', 'seed',
+    'symmetry_maps'
+)
+MAX_SYMMETRY_MAPS = 24
+RMS_CHUNK_SIZE = 2 ** 20  # number of coordinates aligned at once
+
+
+class MissingParametersError(ValueError):
+    """Raised when force field parameters are not available for molecule."""
 
 
 def get_args(argv=None):
@@ -15,13 +51,18 @@ def get_args(argv=None):
     group = prsr.add_mutually_exclusive_group(required=True)
     group.add_argument(
         '-m', '--molecules', nargs='+',
-        help='One or more files with molecule specification.'
+        help='One or more files with molecule specification: .mol files or '
+             'multi-molecule .sdf files (possibly gzip-compressed, .sdf.gz). '
+             '.sdf files are read lazily, molecule by molecule, and '
+             'conformers of all molecules from such file are written to '
+             'single "[name]_confs.sdf" and "[name]_min_confs.sdf" files.'
     )
     group.add_argument(
         '-d', '--directory', help='Directory with .mol files.'
     )
     prsr.add_argument(
-        '-o', '--output_dir', default='.\\confsearch', help='Output directory.'
+        '-o', '--output_dir', default=os.path.join('.', 'confsearch'),
+        help='Output directory.'
     )
     prsr.add_argument(
         '-n', '--num_confs', type=int, default=10,
@@ -44,6 +85,105 @@ def get_args(argv=None):
         '-f', '--fixed', type=int, nargs='+', default=(),
         help='Indices (starting at 1) of atoms fixed during molecule embedding.'
     )
+    prsr.add_argument(
+        '-w', '--workers', type=int, default=1,
+        help='Number of processes used for conformers minimization. '
+             'If 0 is given, all available CPUs are used. Defaults to 1.'
+    )
+    prsr.add_argument(
+        '-i', '--incremental', action='store_true',
+        help='Compare each conformer with those found so far right after its '
+             'minimization and discard it immediately if it is outside '
+             'energy window or similar conformer of lower energy was found. '
+             'Conformers are embedded in batches, so memory usage is bounded '
+             'by the number of unique conformers.'
+    )
+    prsr.add_argument(
+        '-u', '--max_unique', type=int, default=None,
+        help='Stop search when this number of unique conformers is found. '
+             'Implies --incremental.'
+    )
+    prsr.add_argument(
+        '-b', '--batch_size', type=int, default=100,
+        help='Number of conformers embedded at once in incremental mode. '
+             'Defaults to 100.'
+    )
+    prsr.add_argument(
+        '-s', '--saturation', type=int, default=None,
+        help='Stop search when this number of successive batches did not '
+             'produce any new conformer inside energy window; --num_confs '
+             'is then the maximum number of conformers generated. '
+             'Implies --incremental.'
+    )
+    prsr.add_argument(
+        '-C', '--cluster', choices=CLUSTERING, default=None,
+        help='Cluster conformers found using RMS matrix, instead of filtering '
+             'them with RMS sieve: "butina" for Butina clustering, "average" '
+             'for average-linkage hierarchical clustering, both with '
+             '--rms_tresh as distance threshold. Only lowest-energy conformer '
+             'of each cluster is kept; number of conformers in each cluster '
+             'and its Boltzmann population are written to the report. '
+             'Average-linkage clustering scales with the cube of number of '
+             'conformers, so it is suitable only for up to a few thousand '
+             'of them.'
+    )
+    prsr.add_argument(
+        '-t', '--temperature', type=float, default=298.15,
+        help='Temperature in kelvins used to calculate Boltzmann populations '
+             'of clusters. Defaults to 298.15.'
+    )
+    prsr.add_argument(
+        '-T', '--torsion_tolerance', type=float, default=None,
+        help='If given, RMS is calculated only for pairs of conformers, '
+             'which torsion angles around all rotatable bonds differ by no '
+             'more than this value in degrees; other pairs are treated as '
+             'different conformers. Speeds up RMS sieve and clustering of '
+             'flexible molecules. Not used in incremental mode.'
+    )
+    prsr.add_argument(
+        '--symmetry_maps', type=int, default=MAX_SYMMETRY_MAPS, metavar='N',
+        help='Maximum number of symmetry-equivalent orderings of atoms '
+             'considered when calculating RMS, defaults to '
+             f'{MAX_SYMMETRY_MAPS}. Time of RMS calculation grows linearly '
+             'with this number, so only part of the symmetry of highly '
+             'symmetric molecules (e.g. with several tBu or CF3 groups) is '
+             'taken into account by default. Use 1 to ignore symmetry.'
+    )
+    prsr.add_argument(
+        '-k', '--top_k', type=int, default=None,
+        help='Keep only this number of lowest-energy unique conformers; '
+             'they are written sorted by energy. In incremental mode, no '
+             'more than this number of conformers is retained at any time.'
+    )
+    prsr.add_argument(
+        '-S', '--seed', type=int, default=None,
+        help='Random seed for conformers embedding. If given, the same '
+             'conformers and energies are found in each run with the same '
+             'engine, regardless of number of workers, jobs and threads '
+             'used. In incremental mode, seed of each batch is derived from '
+             'this one. Seed is written to the report. By default, random '
+             'seed is used.'
+    )
+    prsr.add_argument(
+        '-j', '--jobs', type=int, default=1,
+        help='Number of molecules processed concurrently, each in separate '
+             'process. If 0 is given, all available CPUs are used. Larger '
+             'molecules are started first. Defaults to 1.'
+    )
+    prsr.add_argument(
+        '-g', '--engine', choices=ENGINES, default='loop',
+        help='Method of conformers generation and minimization. "loop" '
+             'minimizes each conformer separately, "bulk" embeds conformers '
+             'and optimizes them all at once using all available threads. '
+             '"bulk" cannot be used with --fixed or --constraints, "loop" is '
+             'used instead if any of them is given. Defaults to "loop".'
+    )
+    prsr.add_argument(
+        '-F', '--force_field', choices=FORCE_FIELDS, default='MMFF94',
+        help='Force field used for conformers minimization. UFF may be used '
+             'for molecules that MMFF cannot handle, e.g. containing metal '
+             'atoms. Defaults to "MMFF94".'
+    )
     prsr.add_argument(
         '-x', '--constraints',
         help='File with constraints specified in format '
@@ -59,6 +199,78 @@ def get_args(argv=None):
              'if `kind` is P. `const` is force constant for given constraint, '
              'should be integer or float, defaults to 1e5.'
     )
+    prsr.add_argument(
+        '--single_file', action='store_true',
+        help='Write conformers of all molecules to single '
+             '"confsearch_confs.sdf" file in output directory, instead of '
+             'separate files for each molecule. Energy, relative energy and '
+             'name of the molecule are stored as properties of each '
+             'conformer. An index file "confsearch_confs.sdf.index" with '
+             'position of each molecule in the file is also written.'
+    )
+    prsr.add_argument(
+        '-z', '--gzip', action='store_true',
+        help='Compress file written with --single_file using gzip.'
+    )
+    prsr.add_argument(
+        '--resume', action='store_true',
+        help='Resume interrupted search: skip molecules already finished and '
+             'restart unfinished ones from their last checkpoint. Checkpoints '
+             'are stored in "checkpoints" subdirectory of output directory '
+             'and removed when all molecules are finished.'
+    )
+    prsr.add_argument(
+        '--checkpoint_interval', type=float, default=300, metavar='SECONDS',
+        help='Minimum time between checkpoints of a search, that may be '
+             'resumed with --resume, defaults to 300 seconds. Searches '
+             'shorter than this are not checkpointed at all.'
+    )
+    prsr.add_argument(
+        '--no_cache', action='store_false', dest='cache',
+        help='Do not use cache of results of previous searches. By default, '
+             'results are stored in "cache" subdirectory of output directory '
+             'and reused if the same molecule is searched with the same '
+             'parameters again.'
+    )
+    prsr.add_argument(
+        '--cache_size', type=float, default=1024,
+        help='Maximum size of cache in megabytes. Least recently used '
+             'entries are removed if cache grows bigger. Defaults to 1024.'
+    )
+    prsr.add_argument(
+        '--gjf', metavar='ROUTE',
+        help='Write also a .gjf file for each conformer found, with given '
+             'calculation specification (route), to "gjf" directory in output '
+             'directory. Files are named "[name][number].gjf", conformers are '
+             'numbered in order of writing to "_confs.sdf" file.'
+    )
+    prsr.add_argument(
+        '--gjf_link', default='',
+        help='List of link-0 commands for .gjf files, each "%%" character '
+             'starts a new command.'
+    )
+    prsr.add_argument(
+        '--gjf_chk',
+        help='Directory of .chk files, if given, "%%chk=" command is added '
+             'to each .gjf file, naming .chk file after .gjf file.'
+    )
+    prsr.add_argument(
+        '--charge', type=int, default=None,
+        help="Molecule's charge written to .gjf files. Defaults to formal "
+             "charge of each molecule."
+    )
+    prsr.add_argument(
+        '--multiplicity', type=int, default=None,
+        help="Molecule's spin multiplicity written to .gjf files. Defaults "
+             "to one plus number of radical electrons of each molecule."
+    )
+    prsr.add_argument(
+        '--profile', action='store_true',
+        help='Profile search of each molecule with cProfile and save results '
+             'to "profiles/[name].prof" files in output directory. '
+             'Minimization performed in separate processes (see --workers) '
+             'is not included.'
+    )
     prsr.add_argument(
         '-V', '--verbose', action='store_true',
         help='Sets logging level to INFO.'
@@ -67,7 +279,10 @@ def get_args(argv=None):
         '-D', '--debug', action='store_true',
         help='Sets logging level to DEBUG.'
     )
-    return prsr.parse_args(argv)
+    args = prsr.parse_args(argv)
+    if args.gzip and not args.single_file:
+        prsr.error("--gzip needs --single_file to be specified.")
+    return args
 
 
 def parse_constraints(params, std_const=1e5):
@@ -109,20 +324,432 @@ def get_constraints(file, std_const=1e5):
         return [parse_constraints(line, std_const) for line in f]
 
 
-def make_constraints(ff, constraints):
+def make_constraints(ff, constraints, force_field='MMFF94'):
     """Adds specified constraints to given ForceField object, returns that
-    object."""
+    object. `force_field` should be the name of force field `ff` represents,
+    as UFF uses its own constraints makers."""
+    prefix = 'UFF' if force_field == 'UFF' else 'MMFF'
     cm = {  # constraints makers
-        'a': ff.MMFFAddAngleConstraint, 'p': ff.MMFFAddPositionConstraint,
-        'd': ff.MMFFAddDistanceConstraint, 't': ff.MMFFAddTorsionConstraint
+        'a': getattr(ff, prefix + 'AddAngleConstraint'),
+        'p': getattr(ff, prefix + 'AddPositionConstraint'),
+        'd': getattr(ff, prefix + 'AddDistanceConstraint'),
+        't': getattr(ff, prefix + 'AddTorsionConstraint')
     }
     for kind, *params in constraints:
         cm[kind](*params)
     return ff
 
 
+def _count(stats, key, value=1):
+    """Adds `value` to counter `key` in `stats` dict, if it is not None."""
+    if stats is not None:
+        stats[key] = stats.get(key, 0) + value
+
+
+@contextmanager
+def _timed(stats, stage):
+    """Context manager adding time spent in its block to "[stage]_time"
+    counter in `stats` dict, if it is not None."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _count(stats, stage + '_time', time.perf_counter() - start)
+
+
+class ForceFieldSetup:
+    """Force field prepared once for a molecule and reused for minimization
+    of all its conformers: atom typing and parameters assignment is done only
+    on creation, then coordinates of each conformer are swapped into the
+    force field. If `constraints` depend on geometry of the conformer
+    (position constraints and relative ones), only parameters are reused
+    and force field itself is rebuilt for each conformer.
+
+    Parameters
+    ----------
+    molecule : rdkit.Mol
+        Molecule, which conformers will be minimized.
+    force_field : str
+        One of "MMFF94" (default), "MMFF94s" or "UFF".
+    constraints : list of lists
+        List of parameters specifying constraints, as returned by
+        `get_constraints`.
+
+    Raises
+    ------
+    ValueError
+        if unknown force field is requested.
+    MissingParametersError
+        if MMFF parameters are not available for `molecule`."""
+
+    def __init__(self, molecule, force_field='MMFF94', constraints=()):
+        if force_field not in FORCE_FIELDS:
+            raise ValueError(
+                f"Unknown force field: {force_field}. Should be one of: "
+                f"{', '.join(FORCE_FIELDS)}."
+            )
+        self.force_field = force_field
+        self.constraints = constraints
+        if force_field == 'UFF':
+            self.properties = None
+            if not AllChem.UFFHasAllMoleculeParams(molecule):
+                lgg.warning("UFF parameters missing for some atoms.")
+        else:
+            self.properties = AllChem.MMFFGetMoleculeProperties(
+                molecule, mmffVariant=force_field
+            )
+            if self.properties is None:
+                raise MissingParametersError(
+                    f"{force_field} parameters not available for molecule, "
+                    "try UFF force field instead."
+                )
+        self.reusable = all(
+            kind != 'p' and not params[-4] for kind, *params in constraints
+        )
+        self._ff = None
+        if self.reusable:
+            # force field keeps a reference to conformer's coordinates,
+            # so it is bound to a single conformer of private copy
+            self._molecule = Chem.Mol(molecule)
+            self._molecule.RemoveAllConformers()
+            self._molecule.AddConformer(
+                Chem.Conformer(molecule.GetNumAtoms()), assignId=True
+            )
+            self._conformer = self._molecule.GetConformer()
+            self._ff = self.build(self._molecule)
+
+    def build(self, molecule, cid=-1):
+        """Returns new, initialized ForceField object for conformer `cid`
+        of `molecule`, with constraints added."""
+        if self.force_field == 'UFF':
+            ff = AllChem.UFFGetMoleculeForceField(molecule, confId=cid)
+        else:
+            ff = AllChem.MMFFGetMoleculeForceField(
+                molecule, self.properties, confId=cid
+            )
+        ff.Initialize()
+        return make_constraints(ff, self.constraints, self.force_field)
+
+    def minimize(self, conformer, max_cycles, stats=None):
+        """Minimizes `conformer` in place. If `stats` dict is given, time
+        spent on force field setup and on minimization, as well as number
+        of minimization cycles, are added to it.
+
+        Returns
+        -------
+        float or None
+            energy value of minimized conformer or None if minimization did
+            not succeed in `max_cycles` cycles."""
+        with _timed(stats, 'ff_setup'):
+            if self.reusable:
+                ff = self._ff
+                _set_positions(self._conformer, conformer.GetPositions())
+            else:
+                ff = self.build(conformer.GetOwningMol(), conformer.GetId())
+        with _timed(stats, 'minimization'):
+            for cycle in range(max_cycles):
+                if not ff.Minimize():
+                    # ff.Minimize() returns 0 on success
+                    energy = ff.CalcEnergy()
+                    break
+            else:
+                energy = None
+        _count(stats, 'minimization_cycles', cycle + 1)
+        if self.reusable:
+            _set_positions(conformer, self._conformer.GetPositions())
+        return energy
+
+
+def _minimize_conformers(
+        molecule, cids, max_cycles, constraints, stats=None,
+        force_field='MMFF94', setup=None
+):
+    """Minimizes conformers of given ids in place with given force field.
+    `setup` should be a ForceFieldSetup for `molecule`, if not given, it is
+    created. If `stats` dict is given, time spent on force field setup and on
+    minimization, as well as number of minimization cycles, are added to it.
+
+    Returns
+    -------
+    dict
+        mapping of {id: energy value} for each conformer given; energy value
+        is None if minimization did not succeed in `max_cycles` cycles."""
+    if setup is None:
+        with _timed(stats, 'ff_setup'):
+            setup = ForceFieldSetup(molecule, force_field, constraints)
+    return {
+        cid: setup.minimize(molecule.GetConformer(cid), max_cycles, stats)
+        for cid in cids
+    }
+
+
+def _set_positions(conformer, positions):
+    """Sets coordinates of all atoms in `conformer` to given `positions`."""
+    for atom, pos in enumerate(positions):
+        conformer.SetAtomPosition(atom, pos.tolist())
+
+
+def _minimize_chunk(
+        molecule, positions, max_cycles, constraints, force_field='MMFF94'
+):
+    """Worker function for process pool: minimizes conformers on its own copy
+    of `molecule`. `positions` should be a mapping of {id: atoms positions}
+    of conformers to minimize, conformers are created from it, so `molecule`
+    may be sent without conformers, to keep pickled data small. Returns
+    a tuple of mapping of {id: (energy value, atoms positions)}, where energy
+    value is None if minimization failed, and a dict of statistics of
+    minimization."""
+    molecule = Chem.Mol(molecule)
+    molecule.RemoveAllConformers()
+    for cid, pos in positions.items():
+        conformer = Chem.Conformer(molecule.GetNumAtoms())
+        conformer.SetId(cid)
+        _set_positions(conformer, pos)
+        molecule.AddConformer(conformer)
+    stats = {}
+    energies = _minimize_conformers(
+        molecule, list(positions), max_cycles, constraints, stats,
+        force_field
+    )
+    return {
+        cid: (en, molecule.GetConformer(cid).GetPositions())
+        for cid, en in energies.items()
+    }, stats
+
+
+def _minimize_parallel(
+        molecule, cids, max_cycles, constraints, workers, stats=None,
+        force_field='MMFF94', callback=None, executor=None
+):
+    """Distributes conformers minimization over a pool of `workers` processes
+    and copies optimized coordinates back to `molecule` as soon as each chunk
+    of conformers is finished. Returns mapping of {id: energy value} in order
+    of `cids`, as `_minimize_conformers` does. Statistics of minimization are
+    summed over processes in `stats`. If `callback` is given, it is called
+    with mapping of {id: energy value} of conformers finished so far after
+    each chunk. `executor` is a process pool to use, if not given, new one
+    is created for this call only."""
+    chunksize = max(1, ceil(len(cids) / (workers * 4)))
+    chunks = [cids[i:i+chunksize] for i in range(0, len(cids), chunksize)]
+    results = {}
+    # conformers are sent as positions only, not with pickled molecule
+    template = Chem.Mol(molecule, True)
+    with ExitStack() as stack:
+        if executor is None:
+            executor = stack.enter_context(
+                ProcessPoolExecutor(max_workers=workers)
+            )
+        futures = [
+            executor.submit(
+                _minimize_chunk, template,
+                {cid: molecule.GetConformer(cid).GetPositions()
+                 for cid in chunk},
+                max_cycles, constraints, force_field
+            ) for chunk in chunks
+        ]
+        for future in as_completed(futures):
+            result, chunk_stats = future.result()
+            for cid, (energy, positions) in result.items():
+                if energy is not None:
+                    _set_positions(molecule.GetConformer(cid), positions)
+                results[cid] = energy
+            for key, value in chunk_stats.items():
+                _count(stats, key, value)
+            lgg.info(f"Minimization progress: {len(results)}/{len(cids)}")
+            if callback is not None:
+                callback(results)
+    return {cid: results[cid] for cid in cids}
+
+
+@contextmanager
+def minimization_pool(workers, engine='loop'):
+    """Context manager yielding a process pool of `workers` processes
+    (or number of available CPUs, if 0 is given) to be shared by successive
+    `_minimize` calls, or None, if minimization is done in current process
+    anyway."""
+    workers = workers or os.cpu_count() or 1
+    if engine == 'bulk' or workers == 1:
+        yield None
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        yield executor
+
+
+def select_engine(engine, coord_map, constraints):
+    """Returns name of engine that will actually be used for conformational
+    search: "bulk" engine falls back to "loop" if `coord_map` or
+    `constraints` are given, as they require per-conformer setup."""
+    if engine not in ENGINES:
+        raise ValueError(
+            f"Unknown engine: {engine}. Should be one of: {', '.join(ENGINES)}."
+        )
+    if engine == 'bulk' and (coord_map or constraints):
+        return 'loop'
+    return engine
+
+
+def _minimize_bulk(molecule, max_cycles, force_field='MMFF94'):
+    """Optimizes all conformers of `molecule` at once with given force field,
+    using all available threads. Number of iterations is equivalent to
+    `max_cycles` calls of ff.Minimize(). Returns mapping of {id: energy value},
+    as `_minimize_conformers` does. Raises MissingParametersError if MMFF
+    parameters are not available for `molecule`, as `ForceFieldSetup` does."""
+    if force_field != 'UFF' and not AllChem.MMFFHasAllMoleculeParams(molecule):
+        raise MissingParametersError(
+            f"{force_field} parameters not available for molecule, "
+            "try UFF force field instead."
+        )
+    if force_field == 'UFF':
+        if not AllChem.UFFHasAllMoleculeParams(molecule):
+            lgg.warning("UFF parameters missing for some atoms.")
+        results = AllChem.UFFOptimizeMoleculeConfs(
+            molecule, numThreads=0, maxIters=200 * max_cycles
+        )
+    else:
+        results = AllChem.MMFFOptimizeMoleculeConfs(
+            molecule, numThreads=0, maxIters=200 * max_cycles,
+            mmffVariant=force_field
+        )
+    return {
+        conf.GetId(): None if not_converged else energy
+        for conf, (not_converged, energy)
+        in zip(molecule.GetConformers(), results)
+    }
+
+
+def _embed(
+        molecule, num_confs, rms_tresh, coord_map, engine, stats=None,
+        seed=None
+):
+    """Embeds `num_confs` new conformers in `molecule`, removing existing
+    ones. Returns list of new conformers' ids. If `seed` is given, it is used
+    as random seed; embedding is then reproducible regardless of number of
+    threads used. Time spent and number of conformers embedded are added to
+    `stats` dict, if given, as well as seed used (to list under "seeds" key).
+    """
+    kwargs = {} if seed is None else {'randomSeed': seed}
+    with _timed(stats, 'embedding'):
+        ids = list(AllChem.EmbedMultipleConfs(
+            molecule, numConfs=num_confs, pruneRmsThresh=rms_tresh,
+            coordMap=coord_map, numThreads=0 if engine == 'bulk' else 1,
+            **kwargs
+        ))
+    _count(stats, 'embedded', len(ids))
+    if stats is not None and seed is not None:
+        stats.setdefault('seeds', []).append(seed)
+    return ids
+
+
+def batch_seed(seed, batch):
+    """Returns random seed for `batch`-th batch of incremental search,
+    derived from `seed`, or None if `seed` is None."""
+    if seed is None:
+        return None
+    state = np.random.SeedSequence([seed, batch]).generate_state(1)
+    return int(state[0] >> 1)  # non-negative 31-bit integer
+
+
+def save_checkpoint(base, molecule, state):
+    """Saves coordinates of all conformers of `molecule` to "base.npz" file
+    and `state`, which should be JSON-serializable, to "base.json" file."""
+    os.makedirs(os.path.dirname(base) or '.', exist_ok=True)
+    tmp = f".{os.getpid()}.tmp"
+    confs = list(molecule.GetConformers())
+    with open(base + '.npz' + tmp, 'wb') as file:
+        np.savez(
+            file, ids=np.array([c.GetId() for c in confs], dtype=int),
+            positions=np.array([c.GetPositions() for c in confs])
+        )
+    with open(base + '.json' + tmp, 'w') as file:
+        json.dump(state, file)
+    os.replace(base + '.npz' + tmp, base + '.npz')
+    os.replace(base + '.json' + tmp, base + '.json')
+
+
+def load_checkpoint(base, molecule):
+    """Restores conformers saved with `save_checkpoint` in `molecule`,
+    replacing its existing conformers. Returns saved state or None,
+    if there is no valid checkpoint at `base`."""
+    try:
+        with open(base + '.json') as file:
+            state = json.load(file)
+        with np.load(base + '.npz') as data:
+            ids, positions = data['ids'], data['positions']
+    except (OSError, ValueError, KeyError):
+        return None
+    if positions.size and positions.shape[1] != molecule.GetNumAtoms():
+        return None
+    molecule.RemoveAllConformers()
+    for cid, pos in zip(ids.tolist(), positions):
+        conf = Chem.Conformer(molecule.GetNumAtoms())
+        _set_positions(conf, pos)
+        conf.SetId(cid)
+        molecule.AddConformer(conf, assignId=False)
+    lgg.info(f"Search restored from checkpoint {base}.")
+    return state
+
+
+def remove_checkpoint(base):
+    """Removes checkpoint files saved with `save_checkpoint`, if any."""
+    for ext in ('.npz', '.json'):
+        try:
+            os.remove(base + ext)
+        except FileNotFoundError:
+            pass
+
+
+def _minimize(
+        molecule, ids, max_cycles, constraints, workers, engine, stats=None,
+        force_field='MMFF94', setup=None, callback=None, executor=None
+):
+    """Minimizes conformers of given ids with given engine and force field.
+    Returns mapping of {id: energy value}; energy value is None if
+    minimization failed. Statistics of minimization are added to `stats`
+    dict, if given. `setup` is a ForceFieldSetup reused by "loop" engine
+    in current process, if not given, new one is created. "loop" engine
+    calls `callback`, if given, with mapping of {id: energy value} of
+    conformers minimized so far, each time a portion of them is finished,
+    and uses process pool `executor`, if given, see `minimization_pool`."""
+    workers = workers or os.cpu_count() or 1
+    if engine == 'bulk':
+        lgg.info(f"Starting bulk minimization of {len(ids)} conformers.")
+        with _timed(stats, 'minimization'):
+            minimized = _minimize_bulk(molecule, max_cycles, force_field)
+    elif workers > 1 and len(ids) > 1:
+        lgg.info(
+            f"Starting minimization of {len(ids)} conformers "
+            f"using {workers} processes."
+        )
+        minimized = _minimize_parallel(
+            molecule, ids, max_cycles, constraints, workers, stats,
+            force_field, callback, executor
+        )
+    else:
+        lgg.info(f"Starting minimization of {len(ids)} conformers.")
+        if setup is None:
+            with _timed(stats, 'ff_setup'):
+                setup = ForceFieldSetup(molecule, force_field, constraints)
+        minimized = {}
+        for num in range(0, len(ids), 100):
+            if num:
+                lgg.info(f"Minimization progress: {num}/{len(ids)}")
+            minimized.update(_minimize_conformers(
+                molecule, ids[num:num+100], max_cycles, constraints, stats,
+                setup=setup
+            ))
+            if callback is not None:
+                callback(minimized)
+    _count(
+        stats, 'failed',
+        sum(1 for energy in minimized.values() if energy is None)
+    )
+    return minimized
+
+
 def find_lowest_energy_conformer(
-        molecule, num_confs, rms_tresh, max_cycles, coord_map, constraints
+        molecule, num_confs, rms_tresh, max_cycles, coord_map, constraints,
+        workers=1, engine='loop', checkpoint=None, checkpoint_interval=300,
+        stats=None, force_field='MMFF94', seed=None
 ):
     """Performs a conformational search, keeping track of lowest energy
     conformer.
@@ -144,6 +771,35 @@ def find_lowest_energy_conformer(
     constraints : list of lists
         List of parameters specifying constraints, if empty list given,
         optimization without any constraints is performed.
+    workers : int
+        Number of processes used for minimization, defaults to 1 (minimization
+        is performed in current process); if 0 is given, number of available
+        CPUs is used.
+    engine : str
+        "loop" (default) to minimize each conformer separately, possibly
+        in parallel, or "bulk" to embed conformers and optimize them all in
+        one call using all available threads; `workers` is ignored in the
+        latter case. "bulk" falls back to "loop" if `coord_map` or
+        `constraints` are given.
+    checkpoint : str, optional
+        Path (without extension) to checkpoint files. If given, embedded
+        conformers and energies of minimized ones are saved there, when
+        at least `checkpoint_interval` seconds passed since the search
+        started or since the last save ("bulk" engine may save only after
+        embedding). If checkpoint already exists, search is resumed from it.
+    checkpoint_interval : float
+        Minimum time in seconds between checkpoints, defaults to 300.
+    stats : dict, optional
+        If given, it is updated with times spent in each stage of the search
+        (under "[stage]_time" keys) and counters of conformers embedded,
+        minimization cycles used and failed minimizations.
+    force_field : str
+        Force field used for minimization: "MMFF94" (default), "MMFF94s"
+        or "UFF". Its parameters are assigned once and reused for all
+        conformers.
+    seed : int, optional
+        Random seed for conformers embedding; if given, results do not
+        depend on number of `workers` nor threads used.
 
     Returns
     -------
@@ -153,30 +809,47 @@ def find_lowest_energy_conformer(
         min_en is energy value of lowest energy conformer;
         energies is a mapping of {id: energy value} for each conformer generated.
     """
-    ids = AllChem.EmbedMultipleConfs(
-        molecule, numConfs=num_confs, pruneRmsThresh=rms_tresh,
-        coordMap=coord_map
-    )
-    lgg.info("Conformers initialized, starting minimization.")
+    engine = select_engine(engine, coord_map, constraints)
+    saved = time.perf_counter()
+
+    def save(minimized):
+        nonlocal saved
+        if checkpoint and time.perf_counter() - saved >= checkpoint_interval:
+            save_checkpoint(checkpoint, molecule, {
+                'ids': ids, 'minimized': list(minimized.items())
+            })
+            saved = time.perf_counter()
+
+    state = load_checkpoint(checkpoint, molecule) if checkpoint else None
+    if state is not None:
+        ids, minimized = state['ids'], dict(state['minimized'])
+    else:
+        ids = _embed(
+            molecule, num_confs, rms_tresh, coord_map, engine, stats, seed
+        )
+        minimized = {}
+        lgg.info(f"{len(ids)} conformers initialized.")
+    remaining = [cid for cid in ids if cid not in minimized]
+    setup = None
+    if engine == 'loop' and remaining:
+        with _timed(stats, 'ff_setup'):
+            setup = ForceFieldSetup(molecule, force_field, constraints)
+    save(minimized)
+    if remaining:
+        done = dict(minimized)
+        minimized.update(_minimize(
+            molecule, remaining, max_cycles, constraints, workers, engine,
+            stats, force_field, setup,
+            callback=lambda new: save({**done, **new})
+        ))
+    minimized = {cid: minimized[cid] for cid in ids}
     min_en, min_id = float('inf'), -1
     energies = {}
-    stereo = Chem.FindMolChiralCenters(molecule)
-    mp = AllChem.MMFFGetMoleculeProperties(molecule)
-    for cid in ids:
-        if cid and cid % 100 == 0:
-            lgg.info(f"Minimization progress: {cid}/{len(ids)}")
-        ff = AllChem.MMFFGetMoleculeForceField(molecule, mp, confId=cid)
-        ff.Initialize()
-        ff = make_constraints(ff, constraints)
-        for cycle in range(max_cycles):
-            if not ff.Minimize():
-                # ff.Minimize() returns 0 on success
-                break
-        else:
+    for cid, energy in minimized.items():
+        if energy is None:
             molecule.RemoveConformer(cid)
-            lgg.debug(f"Conf {cid} ignored: ff.Minimize() unsuccessfull")  
+            lgg.debug(f"Conf {cid} ignored: ff.Minimize() unsuccessfull")
             continue
-        energy = ff.CalcEnergy()
         lgg.debug(f"Conf {cid} lowest energy: {energy}")
         energies[cid] = energy
         if energy < min_en:
@@ -191,9 +864,767 @@ def find_lowest_energy_conformer(
     return molecule, min_id, min_en, energies
     
 
-def rms_sieve(molecule, energies, threshold):
+def _kabsch_from_covariance(covariance, squares, num_atoms):
+    """Calculates RMS after optimal superposition from covariance matrices
+    of shape (..., 3, 3) of centered positions and sums of squares of
+    centered positions of both structures of shape (...). Singular values
+    of covariance are found as square roots of eigenvalues of its product
+    with its transposition, which is much faster than SVD of 3x3 matrices."""
+    product = np.matmul(np.swapaxes(covariance, -1, -2), covariance)
+    sigma = np.sqrt(np.clip(np.linalg.eigvalsh(product), 0, None))
+    # eigenvalues are in ascending order, the smallest one changes sign
+    # if optimal rotation would be a reflection
+    sign = np.sign(np.linalg.det(covariance))
+    total = sigma[..., 2] + sigma[..., 1] + sign * sigma[..., 0]
+    msd = (squares - 2 * total) / num_atoms
+    return np.sqrt(np.clip(msd, 0, None))
+
+
+def kabsch_rms(reference, probes):
+    """Calculates RMS between `reference` and each of `probes` after their
+    optimal superposition, using Kabsch algorithm.
+
+    Parameters
+    ----------
+    reference : numpy.ndarray
+        Atoms positions of shape (n_atoms, 3).
+    probes : numpy.ndarray
+        Atoms positions of shape (n_probes, n_atoms, 3).
+
+    Returns
+    -------
+    numpy.ndarray
+        RMS values of shape (n_probes,)."""
+    reference = reference - reference.mean(axis=0)
+    probes = probes - probes.mean(axis=1, keepdims=True)
+    covariance = np.matmul(np.swapaxes(probes, 1, 2), reference)
+    squares = (reference ** 2).sum() + (probes ** 2).sum(axis=(1, 2))
+    return _kabsch_from_covariance(covariance, squares, reference.shape[0])
+
+
+def heavy_atoms(molecule):
+    """Returns list of indices of heavy atoms of `molecule`."""
+    return [a.GetIdx() for a in molecule.GetAtoms() if a.GetAtomicNum() > 1]
+
+
+def _heavy_molecule(molecule):
+    """Returns copy of `molecule` without hydrogen atoms and conformers;
+    heavy atoms retain their order, as returned by `heavy_atoms`."""
+    noh = Chem.RWMol(Chem.Mol(molecule, True))
+    for idx in reversed(range(molecule.GetNumAtoms())):
+        if molecule.GetAtomWithIdx(idx).GetAtomicNum() <= 1:
+            noh.RemoveAtom(idx)
+    return noh.GetMol()
+
+
+def symmetry_maps(molecule, max_maps=MAX_SYMMETRY_MAPS):
+    """Finds symmetry-equivalent orderings of heavy atoms of `molecule`
+    (its automorphisms), ignoring hydrogen atoms and chirality. RMS
+    calculation with `symmetric_rms` takes time proportional to number of
+    orderings, so a warning is logged if there are more than `max_maps`.
+
+    Parameters
+    ----------
+    molecule : rdkit.Mol
+        Molecule, which symmetry should be found.
+    max_maps : int
+        Maximum number of orderings to find, defaults to MAX_SYMMETRY_MAPS.
+
+    Returns
+    -------
+    numpy.ndarray
+        Array of shape (n_maps, n_heavy) of indices to list of heavy atoms,
+        as returned by `heavy_atoms`; identity is always the first map."""
+    noh = _heavy_molecule(molecule)
+    identity = tuple(range(noh.GetNumAtoms()))
+    if max_maps <= 1:
+        return np.array([identity], dtype=int).reshape(1, -1)
+    matches = noh.GetSubstructMatches(
+        noh, uniquify=False, useChirality=False, maxMatches=max_maps + 1
+    )
+    maps = [identity] + [match for match in matches if match != identity]
+    if len(maps) > max_maps:
+        lgg.warning(
+            f"Molecule has more than {max_maps} symmetry-equivalent orderings "
+            "of atoms, only the first ones are considered in RMS calculation."
+        )
+    return np.array(maps[:max_maps], dtype=int).reshape(-1, len(identity))
+
+
+def symmetric_rms(reference, probes, maps):
+    """Calculates RMS between `reference` and each of `probes` like
+    `kabsch_rms` does, but returns the lowest value among all orderings
+    of probe's atoms given in `maps`, as returned by `symmetry_maps`.
+    Instead of reordering atoms of each probe, reference's atoms are
+    reordered once for each map, and probes are processed in chunks of
+    about RMS_CHUNK_SIZE values, so memory used does not depend on number
+    of probes.
+
+    Returns
+    -------
+    numpy.ndarray
+        RMS values of shape (n_probes,)."""
+    num_atoms = reference.shape[0]
+    reference = reference - reference.mean(axis=0)
+    # probe[map] paired with reference is the same as probe paired
+    # with reference[inverse of map]
+    inverse = np.argsort(maps, axis=1)
+    # shape (n_atoms, n_maps * 3)
+    permuted = reference[inverse].transpose(1, 0, 2).reshape(num_atoms, -1)
+    size = max(1, RMS_CHUNK_SIZE // (len(maps) * 9 + num_atoms * 3))
+    rms = np.empty(len(probes))
+    for start in range(0, len(probes), size):
+        chunk = probes[start:start+size]
+        chunk = chunk - chunk.mean(axis=1, keepdims=True)
+        covariance = np.matmul(np.swapaxes(chunk, 1, 2), permuted)
+        covariance = covariance.reshape(len(chunk), 3, len(maps), 3)
+        squares = (reference ** 2).sum() + (chunk ** 2).sum(axis=(1, 2))
+        rms[start:start+size] = _kabsch_from_covariance(
+            covariance.transpose(0, 2, 1, 3), squares[:, None], num_atoms
+        ).min(axis=1)
+    return rms
+
+
+ROTATABLE = Chem.MolFromSmarts(
+    '[!$([NH]!@C(=O))&!D1&!$(*#*)]-&!@[!$([NH]!@C(=O))&!D1&!$(*#*)]'
+)
+
+
+def rotatable_torsions(molecule):
+    """Finds torsions around rotatable bonds of `molecule`, defined by heavy
+    atoms only.
+
+    Returns
+    -------
+    numpy.ndarray
+        Array of shape (n_torsions, 4) of indices to list of heavy atoms,
+        as returned by `heavy_atoms`."""
+    noh = _heavy_molecule(molecule)
+    noh.UpdatePropertyCache(strict=False)
+    Chem.FastFindRings(noh)
+    torsions = []
+    for b, c in noh.GetSubstructMatches(ROTATABLE):
+        a = next(
+            n.GetIdx() for n in noh.GetAtomWithIdx(b).GetNeighbors()
+            if n.GetIdx() != c
+        )
+        d = next(
+            n.GetIdx() for n in noh.GetAtomWithIdx(c).GetNeighbors()
+            if n.GetIdx() != b
+        )
+        torsions.append((a, b, c, d))
+    return np.array(torsions, dtype=int).reshape(-1, 4)
+
+
+def torsion_angles(coords, torsions):
+    """Calculates torsion angles in degrees, given atoms positions `coords`
+    of shape (..., n_atoms, 3) and `torsions` as returned by
+    `rotatable_torsions`. Returns array of shape (..., n_torsions).
+    `torsions` may also have more dimensions, e.g. (n_maps, n_torsions, 4)
+    for torsions under each symmetry map, shape of result is then
+    (..., n_maps, n_torsions)."""
+    p0, p1, p2, p3 = (coords[..., torsions[..., n], :] for n in range(4))
+    axis = p2 - p1
+    axis = axis / np.linalg.norm(axis, axis=-1, keepdims=True)
+    v = p0 - p1
+    v = v - (v * axis).sum(axis=-1, keepdims=True) * axis
+    w = p3 - p2
+    w = w - (w * axis).sum(axis=-1, keepdims=True) * axis
+    x = (v * w).sum(axis=-1)
+    y = (np.cross(axis, v) * w).sum(axis=-1)
+    return np.degrees(np.arctan2(y, x))
+
+
+def torsion_prefilter(reference, probes, tolerance):
+    """Tells which of `probes` may be similar to `reference` conformer,
+    based on their torsion angles.
+
+    Parameters
+    ----------
+    reference : numpy.ndarray
+        Torsion angles of reference conformer, of shape (n_torsions,).
+    probes : numpy.ndarray
+        Torsion angles of probes, of shape (n_probes, n_maps, n_torsions),
+        calculated for each symmetry-equivalent ordering of atoms.
+    tolerance : float
+        Maximum difference of torsion angle in degrees.
+
+    Returns
+    -------
+    numpy.ndarray
+        Boolean array of shape (n_probes,), True for probes that for any
+        ordering of atoms have all torsion angles within `tolerance`."""
+    if not reference.size:
+        return np.ones(len(probes), dtype=bool)
+    diff = np.abs(probes - reference) % 360
+    diff = np.minimum(diff, 360 - diff)
+    return (diff.max(axis=-1) <= tolerance).any(axis=-1)
+
+
+def _admit(
+        energies, positions, energy, coords, rms_tresh, energy_window,
+        maps=None
+):
+    """Decides if newly minimized conformer should be retained, given already
+    retained conformers' `energies` and heavy atoms `positions` (both are
+    mappings of {id: value}). If symmetry `maps` are given, RMS is calculated
+    with `symmetric_rms`. Returns a tuple of (admitted, discarded), where
+    `admitted` is True if new conformer should be retained and `discarded`
+    is a list of ids of retained conformers that should be discarded."""
+    if not energies:
+        return True, []
+    min_en = min(energies.values())
+    if energy > min_en + energy_window:
+        return False, []
+    ids = list(positions)
+    probes = np.stack([positions[cid] for cid in ids])
+    if maps is None:
+        rms = kabsch_rms(coords, probes)
+    else:
+        rms = symmetric_rms(coords, probes, maps)
+    similar = [cid for cid, value in zip(ids, rms) if value <= rms_tresh]
+    if any(energies[cid] <= energy for cid in similar):
+        return False, []
+    discarded = similar
+    if energy < min_en:
+        discarded += [
+            cid for cid, en in energies.items()
+            if en > energy + energy_window and cid not in similar
+        ]
+    return True, discarded
+
+
+def _heap_top(heap, energies):
+    """Returns highest energy among retained conformers, given max-heap of
+    (-energy, id) entries and mapping of {id: energy value} of retained
+    conformers. Entries of conformers no longer retained are dropped."""
+    while heap[0][1] not in energies:
+        heapq.heappop(heap)
+    return -heap[0][0]
+
+
+def incremental_search(
+        molecule, num_confs, rms_tresh, energy_window, max_cycles, coord_map,
+        constraints, workers=1, engine='loop', max_unique=None, batch_size=100,
+        saturation=None, stats=None, checkpoint=None, force_field='MMFF94',
+        top_k=None, seed=None, checkpoint_interval=300,
+        max_maps=MAX_SYMMETRY_MAPS
+):
+    """Performs a conformational search like `find_lowest_energy_conformer`
+    does, but conformers are embedded in batches and each freshly minimized
+    conformer is immediately compared with conformers retained so far:
+    it is discarded if its energy is outside of energy window or if similar
+    conformer of lower energy was already found. Only unique conformers
+    are kept on the `molecule`, so memory usage is bounded by their number.
+
+    Parameters
+    ----------
+    molecule : rdkit.Mol
+        Molecule on which conformational search should be performed.
+    num_confs : int
+        Number of conformers to generate.
+    rms_tresh : float
+        Minimum RMS (heavy atoms only) for conformer to be considered
+        different.
+    energy_window : float
+        Maximum energy difference from lowest energy conformer.
+    max_cycles : int
+        Maximum number of attempts to optimize conformer.
+    coord_map : dict
+        A mapping of atoms, that should stay in specified positions when
+        creating new conformer, as in `find_lowest_energy_conformer`.
+    constraints : list of lists
+        List of parameters specifying constraints, if empty list given,
+        optimization without any constraints is performed.
+    workers : int
+        Number of processes used for minimization, see
+        `find_lowest_energy_conformer`.
+    engine : str
+        Engine used for embedding and minimization, see
+        `find_lowest_energy_conformer`.
+    max_unique : int, optional
+        If given, search is stopped as soon as this number of unique
+        conformers is retained.
+    batch_size : int
+        Number of conformers embedded at once, defaults to 100.
+    saturation : int, optional
+        If given, search is stopped when this number of successive batches
+        didn't produce any new unique conformer inside energy window;
+        `num_confs` is then a maximum number of conformers to generate.
+    stats : dict, optional
+        If given, it is updated with number of batches embedded (under
+        "batches" key), number of conformers rejected as duplicates or
+        outside of energy window (under "rejected" key) and statistics
+        described in `find_lowest_energy_conformer`.
+    checkpoint : str, optional
+        Path (without extension) to checkpoint files. If given, retained
+        conformers and search progress are saved there after a batch, when
+        at least `checkpoint_interval` seconds passed since the search
+        started or since the last save. If checkpoint already exists, search
+        is resumed from it.
+    force_field : str
+        Force field used for minimization, see `find_lowest_energy_conformer`.
+    top_k : int, optional
+        If given, no more than this number of lowest energy unique conformers
+        is retained; conformer of highest energy is discarded when new one
+        is admitted over this limit.
+    seed : int, optional
+        Random seed; seed of each batch is derived from it with `batch_seed`,
+        so resumed search gives the same results as uninterrupted one.
+    checkpoint_interval : float
+        Minimum time in seconds between checkpoints, defaults to 300.
+    max_maps : int
+        Maximum number of symmetry maps used in RMS calculation, see
+        `symmetry_maps`.
+
+    Returns
+    -------
+    list of [molecule, min_id, min_en, energies]
+        as `find_lowest_energy_conformer` does, but only retained conformers
+        are present in `molecule` and `energies`."""
+    engine = select_engine(engine, coord_map, constraints)
+    heavy = heavy_atoms(molecule)
+    maps = symmetry_maps(molecule, max_maps)
+    scratch = Chem.Mol(molecule)
+    setup = None
+    if engine == 'loop':
+        with _timed(stats, 'ff_setup'):
+            setup = ForceFieldSetup(scratch, force_field, constraints)
+    molecule.RemoveAllConformers()
+    state = load_checkpoint(checkpoint, molecule) if checkpoint else None
+    if state is not None:
+        energies = {cid: en for cid, en in state['energies']}
+        next_id, done, batches, idle, stop = state['progress']
+    else:
+        energies = {}
+        next_id, done, batches, idle, stop = 0, 0, 0, 0, False
+    positions = {
+        conf.GetId(): conf.GetPositions()[heavy]
+        for conf in molecule.GetConformers()
+    }
+    # max-heap of retained conformers, entries of discarded ones are
+    # removed lazily, when they reach the top
+    highest = [(-en, cid) for cid, en in energies.items()]
+    heapq.heapify(highest)
+    saved = time.perf_counter()
+    # one process pool is shared by all batches
+    with minimization_pool(workers, engine) as executor:
+        while done < num_confs and not stop:
+            size = min(batch_size, num_confs - done)
+            ids = _embed(
+                scratch, size, rms_tresh, coord_map, engine, stats,
+                batch_seed(seed, batches)
+            )
+            minimized = _minimize(
+                scratch, ids, max_cycles, constraints, workers, engine, stats,
+                force_field, setup, executor=executor
+            )
+            done += size
+            batches += 1
+            new = 0
+            for cid, energy in minimized.items():
+                if energy is None:
+                    lgg.debug(
+                        f"Conf {cid} ignored: ff.Minimize() unsuccessfull"
+                    )
+                    continue
+                if top_k and len(energies) >= top_k \
+                        and energy >= _heap_top(highest, energies):
+                    _count(stats, 'rejected')
+                    continue
+                conf = scratch.GetConformer(cid)
+                coords = conf.GetPositions()[heavy]
+                with _timed(stats, 'deduplication'):
+                    admitted, discarded = _admit(
+                        energies, positions, energy, coords, rms_tresh,
+                        energy_window, maps
+                    )
+                _count(stats, 'rejected', len(discarded) + (not admitted))
+                for old in discarded:
+                    molecule.RemoveConformer(old)
+                    del energies[old], positions[old]
+                    lgg.debug(
+                        f"Conf {old} discarded by new conformer {next_id}."
+                    )
+                if not admitted:
+                    continue
+                conf = Chem.Conformer(conf)
+                conf.SetId(next_id)
+                molecule.AddConformer(conf, assignId=False)
+                energies[next_id], positions[next_id] = energy, coords
+                heapq.heappush(highest, (-energy, next_id))
+                lgg.debug(f"Conf {next_id} retained with energy {energy}")
+                if top_k and len(energies) > top_k:
+                    _heap_top(highest, energies)
+                    _, old = heapq.heappop(highest)
+                    molecule.RemoveConformer(old)
+                    del energies[old], positions[old]
+                    _count(stats, 'rejected')
+                    lgg.debug(f"Conf {old} discarded: not in {top_k} lowest.")
+                next_id += 1
+                new += 1
+                if max_unique and len(energies) >= max_unique:
+                    lgg.info(f"{max_unique} unique conformers found.")
+                    stop = True
+                    break
+            idle = 0 if new else idle + 1
+            lgg.info(
+                f"Search progress: {done}/{num_confs}, batch {batches} gave "
+                f"{new} new conformers, {len(energies)} unique conformers."
+            )
+            if saturation and idle >= saturation:
+                lgg.info(
+                    f"No new conformers in last {idle} batches, "
+                    "search saturated."
+                )
+                stop = True
+            elapsed = time.perf_counter() - saved
+            if checkpoint and elapsed >= checkpoint_interval:
+                save_checkpoint(checkpoint, molecule, {
+                    'energies': list(energies.items()),
+                    'progress': [next_id, done, batches, idle, stop]
+                })
+                saved = time.perf_counter()
+    lgg.info(f"Search finished after {batches} batches.")
+    if stats is not None:
+        stats['batches'] = batches
+    if energies:
+        min_id = min(energies, key=energies.get)
+        min_en = energies[min_id]
+    else:
+        min_id, min_en = -1, float('inf')
+    lgg.info(f"Lowest conformer found: {min_en} kcal/mol")
+    return molecule, min_id, min_en, energies
+
+
+def _torsion_angles(coords, maps, torsions):
+    """Returns torsion angles of each conformer in `coords` (heavy atoms
+    positions of shape (n_confs, n_heavy, 3)) for each of symmetry `maps`,
+    as an array of shape (n_confs, n_maps, n_torsions)."""
+    # only atoms of torsions are reordered with each map
+    return torsion_angles(coords, maps[:, torsions])
+
+
+def _rms_row(coords, n, columns, maps, angles=None, tolerance=None,
+             stats=None):
+    """Calculates RMS values between conformer `n` and conformers of given
+    `columns` indices of `coords`, using symmetry `maps`. If `tolerance`
+    is given, RMS is calculated only for pairs that pass `torsion_prefilter`
+    with `angles`, as returned by `_torsion_angles`, and is set to infinity
+    for other pairs."""
+    _count(stats, 'rms_pairs', len(columns))
+    if tolerance is None:
+        return symmetric_rms(coords[n], coords[columns], maps)
+    # first map is identity
+    similar = torsion_prefilter(angles[n, 0], angles[columns], tolerance)
+    row = np.full(len(columns), np.inf)
+    row[similar] = symmetric_rms(coords[n], coords[columns[similar]], maps)
+    _count(stats, 'rms_pairs_skipped', len(columns) - int(similar.sum()))
+    return row
+
+
+def _rms_matrix(coords, maps, torsions=None, tolerance=None, stats=None):
+    """Calculates symmetric square matrix of RMS values between each pair of
+    `coords` (heavy atoms positions of shape (n_confs, n_heavy, 3)), using
+    given symmetry `maps`. If `tolerance` is given, RMS is calculated only for
+    pairs that pass `torsion_prefilter` with `torsions`, as returned by
+    `rotatable_torsions`. See `rms_matrix` for details."""
+    num = len(coords)
+    matrix = np.zeros((num, num))
+    angles = _torsion_angles(coords, maps, torsions) \
+        if tolerance is not None else None
+    for n in range(1, num):
+        row = _rms_row(
+            coords, n, np.arange(n), maps, angles, tolerance, stats
+        )
+        matrix[n, :n] = matrix[:n, n] = row
+    return matrix
+
+
+def rms_matrix(molecule, maps=None, tolerance=None, stats=None):
+    """Calculates RMS values between each pair of conformers of `molecule`,
+    ignoring hydrogen atoms. Symmetry of molecule is taken into account:
+    the lowest RMS among symmetry-equivalent atoms orderings is used.
+
+    Parameters
+    ----------
+    molecule : rdkit.Mol
+        Molecule with conformers embedded.
+    maps : numpy.ndarray, optional
+        Symmetry maps, as returned by `symmetry_maps`; found if not given.
+    tolerance : float, optional
+        If given, RMS is calculated only for pairs of conformers that pass
+        `torsion_prefilter` with this tolerance, RMS of other pairs is set
+        to infinity.
+    stats : dict, optional
+        If given, number of pairs of conformers compared and number of pairs
+        skipped thanks to torsion prefilter are added to it under
+        "rms_pairs" and "rms_pairs_skipped" keys.
+
+    Returns
+    -------
+    numpy.ndarray
+        Symmetric square matrix of RMS values, in order of
+        `molecule.GetConformers()`."""
+    heavy = heavy_atoms(molecule)
+    if maps is None:
+        maps = symmetry_maps(molecule)
+    coords = np.array(
+        [conf.GetPositions()[heavy] for conf in molecule.GetConformers()]
+    ).reshape(-1, len(heavy), 3)
+    torsions = rotatable_torsions(molecule) if tolerance is not None else None
+    return _rms_matrix(coords, maps, torsions, tolerance, stats)
+
+
+def _average_linkage(matrix, threshold):
+    """Performs average-linkage hierarchical clustering of points, given
+    a square matrix of distances between them: clusters are merged as long
+    as average distance between their members is not greater than
+    `threshold`. Returns list of clusters, each being a list of indices.
+    Each merge scans the whole matrix, so time needed grows with the cube
+    of number of points: this is meant for sets of up to a few thousand
+    conformers, Butina clustering should be used for larger ones."""
+    dist = np.array(matrix, dtype=float)
+    np.fill_diagonal(dist, np.inf)
+    clusters = [[n] for n in range(len(dist))]
+    while len(dist):
+        a, b = np.unravel_index(np.argmin(dist), dist.shape)
+        if dist[a, b] > threshold:
+            break
+        size_a, size_b = len(clusters[a]), len(clusters[b])
+        dist[a] = (size_a * dist[a] + size_b * dist[b]) / (size_a + size_b)
+        dist[:, a] = dist[a]
+        dist[a, a] = dist[b] = dist[:, b] = np.inf
+        clusters[a] += clusters[b]
+        clusters[b] = []
+    return [cluster for cluster in clusters if cluster]
+
+
+def boltzmann_weights(energies, temperature=298.15):
+    """Calculates Boltzmann populations of conformers.
+
+    Parameters
+    ----------
+    energies : dict
+        mapping of {id: energy value} for each conformer, in kcal/mol.
+    temperature : float
+        Temperature in kelvins, defaults to 298.15.
+
+    Returns
+    -------
+    dict
+        mapping of {id: population}, populations sum up to 1."""
+    ids = list(energies)
+    values = np.array([energies[cid] for cid in ids])
+    weights = np.exp(-(values - values.min()) / (GAS_CONSTANT * temperature))
+    return dict(zip(ids, (weights / weights.sum()).tolist()))
+
+
+class ConformerStore:
+    """Conformers of a molecule stored in contiguous NumPy arrays: atoms
+    positions of shape (n_confs, n_atoms, 3), energies of shape (n_confs,)
+    (NaN for conformers without energy value) and a keep-mask. Sieves only
+    update the mask and return ids of conformers discarded, conformers are
+    converted back to RDKit objects with `to_molecule`. Conformers without
+    energy value are never discarded.
+
+    Parameters
+    ----------
+    molecule : rdkit.Mol
+        Molecule, which conformers are stored; its conformers are not used.
+    ids : iterable of int
+        Ids of conformers.
+    positions : numpy.ndarray
+        Atoms positions of shape (n_confs, n_atoms, 3).
+    energies : numpy.ndarray
+        Energy values of shape (n_confs,).
+    dtype : numpy.dtype
+        Type of stored positions, defaults to numpy.float64; numpy.float32
+        halves memory usage at the cost of precision.
+    max_maps : int
+        Maximum number of symmetry maps used in RMS calculation, see
+        `symmetry_maps`."""
+
+    def __init__(self, molecule, ids, positions, energies, dtype=np.float64,
+                 max_maps=MAX_SYMMETRY_MAPS):
+        self.molecule = molecule
+        self.heavy = heavy_atoms(molecule)
+        self.ids = np.array(ids, dtype=int).reshape(-1)
+        self.positions = np.ascontiguousarray(positions, dtype=dtype).reshape(
+            len(self.ids), molecule.GetNumAtoms(), 3
+        )
+        self.energies = np.array(energies, dtype=float).reshape(-1)
+        self.keep = np.ones(len(self.ids), dtype=bool)
+        self.max_maps = max_maps
+        self._maps = None
+
+    @classmethod
+    def from_molecule(cls, molecule, energies, dtype=np.float64,
+                      max_maps=MAX_SYMMETRY_MAPS):
+        """Creates store of all conformers of `molecule`, `energies` should
+        be a mapping of {id: energy value}."""
+        confs = list(molecule.GetConformers())
+        positions = np.empty((len(confs), molecule.GetNumAtoms(), 3), dtype)
+        for num, conf in enumerate(confs):
+            positions[num] = conf.GetPositions()
+        ids = [conf.GetId() for conf in confs]
+        return cls(
+            molecule, ids, positions,
+            [energies.get(cid, np.nan) for cid in ids], dtype, max_maps
+        )
+
+    def __len__(self):
+        return int(self.keep.sum())
+
+    @property
+    def kept_ids(self):
+        """List of ids of conformers kept."""
+        return self.ids[self.keep].tolist()
+
+    @property
+    def maps(self):
+        """Symmetry maps of molecule, found on first use."""
+        if self._maps is None:
+            self._maps = symmetry_maps(self.molecule, self.max_maps)
+        return self._maps
+
+    def _candidates(self):
+        """Returns indices of kept conformers with energy value, sorted by
+        energy."""
+        indices = np.flatnonzero(self.keep & ~np.isnan(self.energies))
+        return indices[np.argsort(self.energies[indices], kind='stable')]
+
+    def _discard(self, indices, reason):
+        """Discards conformers of given `indices`, returns their ids."""
+        self.keep[indices] = False
+        ids = self.ids[indices].tolist()
+        for cid in ids:
+            lgg.debug(f"Conf {cid} ignored: {reason}.")
+        return ids
+
+    def _heavy_coords(self, indices):
+        """Returns heavy atoms positions of conformers of given `indices`."""
+        return self.positions[np.ix_(indices, self.heavy)].astype(float)
+
+    def rms_matrix(self, indices, tolerance=None, stats=None):
+        """Returns matrix of RMS values between conformers of given `indices`,
+        see `rms_matrix` for details."""
+        coords = self._heavy_coords(indices)
+        torsions = rotatable_torsions(self.molecule) \
+            if tolerance is not None else None
+        return _rms_matrix(coords, self.maps, torsions, tolerance, stats)
+
+    def energy_sieve(self, threshold):
+        """Discards conformers with energies higher than lowest energy +
+        `threshold`. Returns list of ids of conformers discarded."""
+        known = self.keep & ~np.isnan(self.energies)
+        if not known.any():
+            return []
+        maxen = self.energies[known].min() + threshold
+        return self._discard(
+            np.flatnonzero(known & (self.energies > maxen)),
+            f"energy higher than threshold {maxen}"
+        )
+
+    def rms_sieve(self, threshold, tolerance=None, stats=None):
+        """Discards similar conformers, always keeping the one of lower
+        energy, as described in `rms_sieve`. RMS matrix is not built:
+        RMS values are calculated only between each conformer kept and
+        higher energy conformers not discarded yet. Returns list of ids of
+        conformers discarded."""
+        indices = self._candidates()
+        coords = self._heavy_coords(indices)
+        angles = _torsion_angles(
+            coords, self.maps, rotatable_torsions(self.molecule)
+        ) if tolerance is not None else None
+        keep = np.ones(indices.size, dtype=bool)
+        for n in range(indices.size):
+            if not keep[n]:
+                continue
+            later = n + 1 + np.flatnonzero(keep[n+1:])
+            if later.size:
+                rms = _rms_row(
+                    coords, n, later, self.maps, angles, tolerance, stats
+                )
+                keep[later[rms <= threshold]] = False
+        return self._discard(indices[~keep], "rms under threshold")
+
+    def clusters(self, threshold, method='butina', tolerance=None, stats=None):
+        """Clusters kept conformers, as described in `cluster_conformers`.
+        Returns list of clusters, each being a list of conformers' ids."""
+        if method not in CLUSTERING:
+            raise ValueError(
+                f"Unknown clustering method: {method}. "
+                f"Should be one of: {', '.join(CLUSTERING)}."
+            )
+        # sorted by energy, so members of each cluster may be sorted by index
+        indices = self._candidates()
+        matrix = self.rms_matrix(indices, tolerance, stats)
+        if method == 'butina':
+            # condensed lower triangle, as expected by older RDKit versions
+            clusters = Butina.ClusterData(
+                matrix[np.tril_indices(len(indices), -1)], len(indices),
+                threshold, isDistData=True
+            )
+        else:
+            clusters = _average_linkage(matrix, threshold)
+        clusters = sorted(sorted(cluster) for cluster in clusters)
+        return [self.ids[indices[cluster]].tolist() for cluster in clusters]
+
+    def cluster_sieve(self, clusters, temperature=298.15):
+        """Discards all conformers but representatives of `clusters`, as
+        described in `cluster_sieve`, and returns clusters' summary."""
+        position = {cid: num for num, cid in enumerate(self.ids.tolist())}
+        weights = boltzmann_weights({
+            cid: self.energies[position[cid]]
+            for cluster in clusters for cid in cluster
+        }, temperature) if clusters else {}
+        summary = []
+        for representative, *others in clusters:
+            self._discard(
+                [position[cid] for cid in others],
+                f"in cluster of {representative}"
+            )
+            summary.append({
+                'id': representative, 'size': len(others) + 1,
+                'population': sum(
+                    weights[cid] for cid in (representative, *others)
+                )
+            })
+        return summary
+
+    def top_k_sieve(self, k):
+        """Discards all conformers but `k` of lowest energy. Returns list
+        of ids of conformers discarded."""
+        return self._discard(self._candidates()[k:], f"not in {k} lowest")
+
+    def to_molecule(self, molecule):
+        """Replaces conformers of `molecule` with conformers kept, returns
+        that molecule."""
+        molecule.RemoveAllConformers()
+        for cid, pos in zip(self.kept_ids, self.positions[self.keep]):
+            conf = Chem.Conformer(molecule.GetNumAtoms())
+            _set_positions(conf, pos.astype(float))
+            conf.SetId(cid)
+            molecule.AddConformer(conf, assignId=False)
+        return molecule
+
+
+def _remove_conformers(molecule, ids, energies=None):
+    """Removes conformers of given `ids` from `molecule` and, if given,
+    their entries from `energies` dict."""
+    for cid in ids:
+        molecule.RemoveConformer(cid)
+        if energies is not None:
+            del energies[cid]
+
+
+def rms_sieve(molecule, energies, threshold, tolerance=None, stats=None):
     """Filters similar conformers after optimization, based on threshold given.
-    Always discards conformer of higher energy.
+    Always discards conformer of higher energy: conformers are visited from the
+    lowest energy one and each conformer kept discards all remaining
+    conformers closer to it than `threshold`. Conformers without energy value
+    in `energies` are left intact.
 
     Parameters
     ----------
@@ -203,33 +1634,78 @@ def rms_sieve(molecule, energies, threshold):
         mapping of {id: energy value} for each conformer in molecule.
     threshold : float
         Minimum RMS to treat conformers as different.
+    tolerance : float, optional
+        Tolerance of torsion prefilter, see `rms_matrix`.
+    stats : dict, optional
+        Statistics of RMS calculation, see `rms_matrix`.
 
     Returns
     -------
     rdkit.Mol
         Molecule with conformers filtered."""
     AllChem.AlignMolConformers(molecule)
-    indices = {n: c.GetId() for n, c in enumerate(molecule.GetConformers())}
-    noh = Chem.RemoveHs(molecule)
-    rmsmatrix = AllChem.GetConformerRMSMatrix(noh)
-    for i, rms in enumerate(rmsmatrix):
-        first = floor((sqrt(8*i+1) - 1) / 2)
-        second = indices[i - first * (first + 1) // 2]
-        first = indices[first + 1]
-        if rms > threshold:
-            continue
-        try:
-            fen = energies[first]
-            sen = energies[second]
-        except KeyError:
-            continue
-        throwaway = first if fen > sen else second
-        molecule.RemoveConformer(throwaway)
-        del energies[throwaway]
-        lgg.debug(f"Conf {throwaway} ignored: rms under threshold.")
+    store = ConformerStore.from_molecule(molecule, energies)
+    _remove_conformers(
+        molecule, store.rms_sieve(threshold, tolerance, stats), energies
+    )
     return molecule
-    
-    
+
+
+def cluster_conformers(
+        molecule, energies, threshold, method='butina', tolerance=None,
+        stats=None
+):
+    """Clusters conformers of `molecule` based on RMS matrix (heavy atoms
+    only). Conformers without energy value in `energies` are ignored.
+
+    Parameters
+    ----------
+    molecule : rdkit.Mol
+        Molecule with optimized conformers embedded.
+    energies : dict
+        mapping of {id: energy value} for each conformer in molecule.
+    threshold : float
+        Distance threshold: maximum RMS between Butina cluster's centroid
+        and its members or maximum average RMS between members of merged
+        clusters in case of average-linkage clustering.
+    method : str
+        "butina" (default) or "average"; the latter scales with the cube of
+        number of conformers, see `_average_linkage`.
+    tolerance : float, optional
+        Tolerance of torsion prefilter, see `rms_matrix`.
+    stats : dict, optional
+        Statistics of RMS calculation, see `rms_matrix`.
+
+    Returns
+    -------
+    list of lists
+        ids of conformers in each cluster, sorted by energy, so the first
+        one is cluster's lowest energy conformer, its representative;
+        clusters are sorted by representative's energy."""
+    store = ConformerStore.from_molecule(molecule, energies)
+    return store.clusters(threshold, method, tolerance, stats)
+
+
+def cluster_sieve(molecule, energies, clusters, temperature=298.15):
+    """Discards all conformers but representatives of `clusters`, as returned
+    by `cluster_conformers`. Conformers not present in any cluster are left
+    intact. Remaining conformers are aligned, as after `rms_sieve`.
+
+    Returns
+    -------
+    list of dicts
+        one for each cluster, with id of its representative under "id" key,
+        number of its members under "size" key and its Boltzmann population
+        (sum of populations of its members) under "population" key."""
+    store = ConformerStore.from_molecule(molecule, energies)
+    summary = store.cluster_sieve(clusters, temperature)
+    _remove_conformers(
+        molecule, [cid for cluster in clusters for cid in cluster[1:]]
+    )
+    AllChem.AlignMolConformers(molecule)
+    return summary
+
+
 def energy_sieve(molecule, energies, threshold):
     """Discards conformers with energies higher than lowest energy + threshold.
 
@@ -246,18 +1722,603 @@ def energy_sieve(molecule, energies, threshold):
     -------
     rdkit.Mol
         Molecule with conformers filtered."""
-    minen = min(energies.values())
-    maxen = minen + threshold
-    for cid, en in energies.items():
-        if en > maxen:
-            molecule.RemoveConformer(cid)
-            lgg.debug(
-                f"Conf {cid} ignored: energy {en} "
-                f"higher than theshold {maxen}"
-            )
+    store = ConformerStore.from_molecule(molecule, energies)
+    _remove_conformers(molecule, store.energy_sieve(threshold))
     return molecule
     
     
+def top_k_sieve(molecule, energies, k):
+    """Discards all conformers but `k` of lowest energy.
+
+    Parameters
+    ----------
+    molecule : rdkit.Mol
+        Molecule with optimized conformers embedded.
+    energies : dict
+        mapping of {id: energy value} for each conformer in molecule.
+    k : int
+        Number of conformers to keep.
+
+    Returns
+    -------
+    rdkit.Mol
+        Molecule with conformers filtered."""
+    store = ConformerStore.from_molecule(molecule, energies)
+    _remove_conformers(molecule, store.top_k_sieve(k))
+    return molecule
+
+
+def cache_key(molecule, args, constraints):
+    """Returns a key identifying results of conformational search on given
+    molecule with given parameters. It is based on canonical SMILES (with
+    stereochemistry), order of atoms in `molecule`, positions of fixed atoms,
+    `constraints` and all parameters listed in CACHED_PARAMS."""
+    conf = molecule.GetConformer()
+    params = {name: getattr(args, name) for name in CACHED_PARAMS}
+    params['fixed'] = [
+        [n, *(round(v, 4) for v in conf.GetAtomPosition(n-1))]
+        for n in args.fixed
+    ]
+    params['constraints'] = [list(c) for c in constraints]
+    params['smiles'] = Chem.MolToSmiles(molecule)
+    params['order'] = list(Chem.CanonicalRankAtoms(molecule))
+    text = json.dumps(params, sort_keys=True)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def store_cached(cache_dir, key, molecule, min_id, energies, summary):
+    """Saves conformers of `molecule` and their energies in `cache_dir`
+    as "key.sdf" and "key.json" files."""
+    os.makedirs(cache_dir, exist_ok=True)
+    base = os.path.join(cache_dir, key)
+    tmp = f".{os.getpid()}.tmp"
+    ids = [conf.GetId() for conf in molecule.GetConformers()]
+    writer = Chem.SDWriter(base + '.sdf' + tmp)
+    for cid in ids:
+        writer.write(molecule, confId=cid)
+    writer.close()
+    with open(base + '.json' + tmp, 'w') as file:
+        json.dump({
+            'ids': ids, 'energies': [energies[cid] for cid in ids],
+            'min_id': min_id, 'summary': summary
+        }, file)
+    os.replace(base + '.sdf' + tmp, base + '.sdf')
+    os.replace(base + '.json' + tmp, base + '.json')
+
+
+def load_cached(cache_dir, key, molecule):
+    """Loads conformers stored under given `key` in `cache_dir` into
+    `molecule`, replacing its existing conformers.
+
+    Returns
+    -------
+    list of [molecule, min_id, min_en, energies, summary] or None
+        None is returned if there is no valid entry for `key` in cache."""
+    base = os.path.join(cache_dir, key)
+    try:
+        with open(base + '.json') as file:
+            data = json.load(file)
+        supplier = Chem.SDMolSupplier(
+            base + '.sdf', removeHs=False, sanitize=False
+        )
+        confs = [Chem.Conformer(mol.GetConformer()) for mol in supplier]
+    except (OSError, ValueError, AttributeError):
+        return None
+    if len(confs) != len(data['ids']) or any(
+        conf.GetNumAtoms() != molecule.GetNumAtoms() for conf in confs
+    ):
+        return None
+    molecule.RemoveAllConformers()
+    for cid, conf in zip(data['ids'], confs):
+        conf.SetId(cid)
+        molecule.AddConformer(conf, assignId=False)
+    os.utime(base + '.json')  # mark as recently used
+    energies = dict(zip(data['ids'], data['energies']))
+    min_en = energies[data['min_id']]
+    return molecule, data['min_id'], min_en, energies, data['summary']
+
+
+def evict_cache(cache_dir, max_size):
+    """Removes least recently used entries from `cache_dir` until its size is
+    not bigger than `max_size` bytes."""
+    if not os.path.isdir(cache_dir):
+        return
+    entries = {}
+    for entry in os.scandir(cache_dir):
+        key, ext = os.path.splitext(entry.name)
+        if ext in ('.sdf', '.json'):
+            size, used = entries.get(key, (0, 0))
+            stat = entry.stat()
+            entries[key] = size + stat.st_size, max(used, stat.st_mtime)
+    total = sum(size for size, _ in entries.values())
+    for key in sorted(entries, key=lambda k: entries[k][1]):
+        if total <= max_size:
+            break
+        for ext in ('.sdf', '.json'):
+            try:
+                os.remove(os.path.join(cache_dir, key + ext))
+            except FileNotFoundError:
+                pass
+        total -= entries[key][0]
+        lgg.debug(f"Cache entry {key} evicted.")
+
+
+def conformational_search(
+        molecule, args, constraints, checkpoint=None, stats=None
+):
+    """Performs a conformational search on given molecule as specified by
+    `args` and filters conformers found with `energy_sieve`, `rms_sieve`
+    (or `cluster_sieve`, if `args.cluster` is given) and, if `args.top_k`
+    is given, `top_k_sieve`. If `checkpoint` is given, search progress
+    is saved there every `args.checkpoint_interval` seconds and search is
+    resumed from it, if it already exists. If `stats` dict is given, it is
+    updated with times spent in each stage of the search and number of
+    conformers processed in each stage.
+
+    Returns
+    -------
+    list of [molecule, min_id, min_en, energies, summary], where first four
+    are as returned by `find_lowest_energy_conformer` and summary is a dict
+    with search results to be reported."""
+    m = molecule
+    conf = m.GetConformer()
+    coord_map = {n-1: conf.GetAtomPosition(n-1) for n in args.fixed}
+
+    stats = {} if stats is None else stats
+    summary = {}
+    if args.incremental or args.max_unique or args.saturation:
+        m, cid, en, ens = incremental_search(
+            m, args.num_confs, args.rms_tresh, args.energy_window,
+            args.max_cycles, coord_map, constraints, args.workers,
+            args.engine, args.max_unique, args.batch_size, args.saturation,
+            stats=stats, checkpoint=checkpoint, force_field=args.force_field,
+            top_k=args.top_k, seed=args.seed,
+            checkpoint_interval=args.checkpoint_interval,
+            max_maps=args.symmetry_maps
+        )
+        summary['batches'] = stats['batches']
+    else:
+        m, cid, en, ens = find_lowest_energy_conformer(
+            m, args.num_confs, args.rms_tresh, args.max_cycles, coord_map,
+            constraints, args.workers, args.engine, checkpoint=checkpoint,
+            checkpoint_interval=args.checkpoint_interval, stats=stats,
+            force_field=args.force_field, seed=args.seed
+        )
+    # conformers are sieved as arrays and converted back to RDKit at the end
+    store = ConformerStore.from_molecule(
+        m, ens, max_maps=args.symmetry_maps
+    )
+    m.RemoveAllConformers()
+    num = len(store)
+    lgg.info(f"Number of conformers optimized: {num}")
+    with _timed(stats, 'energy_sieve'):
+        store.energy_sieve(args.energy_window)
+    stats['energy_sieve_removed'] = num - len(store)
+    lgg.info(
+        f"{num-len(store)} conformers outside energy window."
+    )
+    num = len(store)
+    if args.cluster:
+        with _timed(stats, 'clustering'):
+            clusters = store.clusters(
+                args.rms_tresh, args.cluster, args.torsion_tolerance, stats
+            )
+            clusters = store.cluster_sieve(clusters, args.temperature)
+        stats['clustering_removed'] = num - len(store)
+        lgg.info(
+            f"{len(clusters)} clusters of conformers found."
+        )
+    else:
+        with _timed(stats, 'rms_sieve'):
+            store.rms_sieve(args.rms_tresh, args.torsion_tolerance, stats)
+        stats['rms_sieve_removed'] = num - len(store)
+        lgg.info(
+            f"{num-len(store)} conformers discarded by "
+            "RMS sieve."
+        )
+    if args.top_k:
+        num = len(store)
+        store.top_k_sieve(args.top_k)
+        stats['top_k_sieve_removed'] = num - len(store)
+    m = store.to_molecule(m)
+    ens = {cid: ens[cid] for cid in store.kept_ids}
+    if args.cluster:
+        summary['clusters'] = [c for c in clusters if c['id'] in ens]
+    AllChem.AlignMolConformers(m)
+    lgg.info(f"Number of conformers generated: {m.GetNumConformers()}")
+    return m, cid, en, ens, summary
+
+
+def checkpoint_path(args, stem):
+    """Returns path (without extension) to checkpoint files of molecule
+    identified by `stem`."""
+    return os.path.join(args.output_dir, 'checkpoints', stem)
+
+
+def load_done(checkpoint):
+    """Returns summary of finished search saved at `checkpoint` or None,
+    if search is not finished."""
+    try:
+        with open(checkpoint + '.done.json') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def mark_done(checkpoint, summary):
+    """Saves `summary` of finished search and removes checkpoint files."""
+    os.makedirs(os.path.dirname(checkpoint), exist_ok=True)
+    with open(checkpoint + '.done.json', 'w') as file:
+        json.dump(summary, file)
+    remove_checkpoint(checkpoint)
+
+
+def _to_sdf(molecule, ids, energies, name):
+    """Returns conformers of `molecule` of given ids as text in .sdf format.
+    Molecule's `name`, conformer's energy and its energy relative to the
+    lowest energy in `energies` are stored as "molecule", "energy" and
+    "relative_energy" properties respectively."""
+    buffer = io.StringIO()
+    writer = Chem.SDWriter(buffer)
+    min_en = min(energies.values(), default=0)
+    molecule.SetProp('molecule', name)
+    for cid in ids:
+        molecule.SetDoubleProp('energy', energies[cid])
+        molecule.SetDoubleProp('relative_energy', energies[cid] - min_en)
+        writer.write(molecule, confId=cid)
+    writer.close()
+    return buffer.getvalue()
+
+
+def write_gjf(
+        directory, stem, molecule, ids, energies, name, route, link='',
+        chk=None, charge=None, multiplicity=None
+):
+    """Writes conformers of `molecule` of given ids to .gjf files named
+    "[stem][number].gjf" in `directory`, using `sdf_to_gjf.save_molecule`.
+    Coordinates are taken directly from molecule's conformers.
+
+    Parameters
+    ----------
+    directory : str
+        Path to output directory, it is created if not exists.
+    stem : str
+        Base name of the output files.
+    molecule : rdkit.Mol
+        Molecule with conformers embedded.
+    ids : list of int
+        Ids of conformers to write, in order of numeration of output files.
+    energies : dict
+        mapping of {id: energy value}, energy of each conformer is written
+        in its .gjf file's comment, along with molecule's `name`.
+    route : str
+        Calculation specification.
+    link : str
+        List of link-0 commands, as taken by `sdf_to_gjf.parse_link_zero`.
+    chk : str, optional
+        Path to directory of .chk files.
+    charge : int, optional
+        Molecule's charge, defaults to its formal charge.
+    multiplicity : int, optional
+        Molecule's spin multiplicity, defaults to one plus number of radical
+        electrons."""
+    directory = pathlib.Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    if charge is None:
+        charge = Chem.GetFormalCharge(molecule)
+    if multiplicity is None:
+        multiplicity = 1 + sum(
+            atom.GetNumRadicalElectrons() for atom in molecule.GetAtoms()
+        )
+    symbols = [atom.GetSymbol() for atom in molecule.GetAtoms()]
+    linkzero = parse_link_zero(link)
+    chk = pathlib.PurePosixPath(chk) if chk else None
+    for num, cid in enumerate(ids):
+        positions = molecule.GetConformer(cid).GetPositions().tolist()
+        save_molecule(
+            dest=directory / f"{stem}{num:0>3}.gjf",
+            coords=[(a, *xyz) for a, xyz in zip(symbols, positions)],
+            route=route,
+            charge=charge,
+            multipl=multiplicity,
+            comment=f"{name}, energy {energies[cid]:.8f} kcal/mol",
+            linkzero=linkzero,
+            chk_path=chk
+        )
+
+
+def search_molecule(name, stem, block, args, constraints):
+    """Performs a conformational search on molecule given as text in .mol
+    format, as specified by `args`.
+
+    Parameters
+    ----------
+    name : str
+        Name of the molecule, used in log messages.
+    stem : str
+        Unique identifier of the molecule, used for checkpoint files.
+    block : str
+        Molecule specification in .mol format; it may also be a record
+        of .sdf file, molecule's properties are then preserved.
+    args : argparse.Namespace
+        Parameters of conformational search, as returned by `get_args`.
+    constraints : list of lists
+        List of parameters specifying constraints, as returned by
+        `get_constraints`.
+
+    Returns
+    -------
+    list of [summary, min_conf, confs] or None
+        summary is a dict with energy value of lowest energy conformer under
+        "energy" key, number of conformers found under "conformers" key,
+        number of batches embedded under "batches" key (incremental mode
+        only) and a dict of search statistics (times spent in each stage and
+        number of conformers processed) under "stats" key; min_conf is
+        lowest energy conformer and
+        confs are all conformers found, both in .sdf format.
+        None is returned if molecule couldn't be loaded, force field
+        parameters are not available for it or none of its conformers
+        converged."""
+    checkpoint = checkpoint_path(args, stem)
+    if not args.resume:
+        remove_checkpoint(checkpoint)
+    lgg.info(f"Starting with molecule {name}")
+    supplier = Chem.SDMolSupplier()
+    supplier.SetData(block, removeHs=False)
+    m = next(iter(supplier), None)
+    if m is not None:
+        lgg.info('Molecule loaded.')
+    else:
+        lgg.warning(f"Couldn't load molecule {name}")
+        return None
+
+    atoms = {}
+    for atnum in (atom.GetAtomicNum() for atom in m.GetAtoms()):
+        atoms[atnum] = atoms.get(atnum, 0) + 1
+    lgg.debug(f"atoms in structure: {atoms}")
+    Chem.AssignStereochemistryFrom3D(m)
+    lgg.debug(f"Stereochemistry found: {Chem.FindMolChiralCenters(m)}")
+
+    start = time.perf_counter()
+    cache_dir = os.path.join(args.output_dir, 'cache')
+    key = cache_key(m, args, constraints) if args.cache else None
+    cached = load_cached(cache_dir, key, m) if key else None
+    stats = {'cached': cached is not None}
+    if cached is not None:
+        m, cid, en, ens, summary = cached
+        lgg.info(f"Conformers loaded from cache: {m.GetNumConformers()}")
+    else:
+        try:
+            m, cid, en, ens, summary = conformational_search(
+                m, args, constraints, checkpoint, stats
+            )
+        except MissingParametersError as error:
+            lgg.warning(f"Couldn't search molecule {name}: {error}")
+            return None
+        if key and ens:
+            store_cached(cache_dir, key, m, cid, ens, summary)
+    if not ens:
+        lgg.warning(
+            f"No conformers of molecule {name} converged, try increasing "
+            "number of conformers or maximum number of cycles."
+        )
+        return None
+    ids = [conf.GetId() for conf in m.GetConformers()]
+    if args.top_k or args.cluster:
+        ids.sort(key=ens.get)
+    summary['energy'], summary['conformers'] = en, len(ids)
+    ens = {cid: ens[cid] for cid in ids}
+    min_conf = _to_sdf(m, [cid], ens, name)
+    confs = _to_sdf(m, ids, ens, name)
+    if args.gjf:
+        write_gjf(
+            os.path.join(args.output_dir, 'gjf'), stem, m, ids, ens, name,
+            args.gjf, args.gjf_link, args.gjf_chk, args.charge,
+            args.multiplicity
+        )
+    stats['total_time'] = time.perf_counter() - start
+    summary['stats'] = stats
+    return summary, min_conf, confs
+
+
+def _search_item(num, name, stem, block, source, args, constraints):
+    """Calls `search_molecule` for molecule yielded by `read_molecules`;
+    `num` and `source` are ignored. If `args.profile` is True, search is
+    profiled and statistics are saved to "profiles/[stem].prof" file
+    in output directory."""
+    if not args.profile:
+        return search_molecule(name, stem, block, args, constraints)
+    profile = cProfile.Profile()
+    result = profile.runcall(
+        search_molecule, name, stem, block, args, constraints
+    )
+    profiles = os.path.join(args.output_dir, 'profiles')
+    os.makedirs(profiles, exist_ok=True)
+    profile.dump_stats(os.path.join(profiles, stem + '.prof'))
+    return result
+
+
+def _sdf_records(file):
+    """Lazily splits opened .sdf file into records' texts."""
+    record = []
+    for line in file:
+        record.append(line)
+        if line.startswith('$$$$'):
+            yield ''.join(record)
+            record = []
+    if ''.join(record).strip():
+        yield ''.join(record)
+
+
+def is_sdf(path):
+    """Checks if given file is (possibly gzipped) .sdf file."""
+    return path.lower().endswith(('.sdf', '.sdf.gz'))
+
+
+def sdf_stem(path):
+    """Returns file name of given .sdf or .sdf.gz file without extension."""
+    name = os.path.basename(path)
+    return name[:-len('.sdf.gz')] if name.lower().endswith('.gz') \
+        else os.path.splitext(name)[0]
+
+
+def read_molecules(paths):
+    """Lazily reads molecules from given .mol and .sdf files (the latter may
+    be gzip-compressed). Multi-record .sdf files are read record by record,
+    so they are never loaded into memory at once.
+
+    Yields
+    ------
+    tuple of (name, stem, block, source)
+        name is a name of .mol file or of .sdf record (numbered record of
+        the file, if record has no name); stem is unique identifier of the
+        molecule; block is molecule specification as text; source is path
+        to file, which molecule was read from."""
+    for path in paths:
+        if not is_sdf(path):
+            name = os.path.basename(path)
+            with open(path) as file:
+                yield name, os.path.splitext(name)[0], file.read(), path
+            continue
+        stem = sdf_stem(path)
+        opener = gzip.open if path.lower().endswith('.gz') else open
+        with opener(path, 'rt') as file:
+            for num, block in enumerate(_sdf_records(file)):
+                name = block.split('\n', 1)[0].strip() or f"{stem}#{num}"
+                yield name, f"{stem}_{num}", block, path
+
+
+class CombinedWriter:
+    """Writes conformers of many molecules to a single .sdf file, optionally
+    gzip-compressed, and maintains an index file ("[file].index") with
+    a line "name<TAB>offset<TAB>size<TAB>conformers" for each molecule,
+    where offset and size are given in bytes, allowing for random access
+    with `read_combined`. When compressed, each molecule is written as
+    a separate gzip member, so the file is still a valid .sdf.gz file.
+    Output is buffered and both files are flushed once `buffer_size` bytes
+    are collected, data file first, so index never points past its end;
+    callbacks given to `write` are called after flush."""
+
+    def __init__(self, path, compress=False, append=False,
+                 buffer_size=2 ** 20):
+        self.path = path
+        self.compress = compress
+        self.buffer_size = buffer_size
+        self.file = open(path, 'ab' if append else 'wb', buffering=0)
+        self.index = open(path + '.index', 'a' if append else 'w')
+        self.offset = self.file.seek(0, os.SEEK_END)
+        self.buffer = []
+        self.entries = []
+        self.buffered = 0
+        self.callbacks = []
+
+    def write(self, name, records, conformers, callback=None):
+        """Buffers `records` (conformers of molecule of given `name` in .sdf
+        format) for writing; `callback` is called without arguments, when
+        data is actually written to disk."""
+        data = records.encode()
+        if self.compress:
+            data = gzip.compress(data)
+        self.entries.append(
+            f"{name}\t{self.offset}\t{len(data)}\t{conformers}\n"
+        )
+        self.buffer.append(data)
+        self.buffered += len(data)
+        self.offset += len(data)
+        if callback is not None:
+            self.callbacks.append(callback)
+        if self.buffered >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        """Writes buffered data to disk."""
+        self.file.write(b''.join(self.buffer))
+        self.index.write(''.join(self.entries))
+        self.index.flush()
+        self.buffer, self.entries, self.buffered = [], [], 0
+        for callback in self.callbacks:
+            callback()
+        self.callbacks = []
+
+    def close(self):
+        self.flush()
+        self.file.close()
+        self.index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def read_combined(path, name):
+    """Returns conformers of molecule of given `name` in .sdf format, read
+    from file written by `CombinedWriter`, using its index file. If molecule
+    was written more than once, e.g. after resuming, the last entry is used.
+    Raises KeyError if there is no such molecule in the file."""
+    found = None
+    with open(path + '.index') as index:
+        for line in index:
+            entry, offset, size, _ = line.rstrip('\n').rsplit('\t', 3)
+            if entry == name:
+                found = offset, size
+    if found is None:
+        raise KeyError(name)
+    offset, size = found
+    with open(path, 'rb') as file:
+        file.seek(int(offset))
+        data = file.read(int(size))
+    if path.lower().endswith('.gz'):
+        data = gzip.decompress(data)
+    return data.decode()
+
+
+def report_line(name, summary, width):
+    """Formats a line of confsearch report for molecule of given `name`,
+    based on `summary` returned by `search_molecule`."""
+    line = f"{name: <{width}} = {summary['energy']: > 13.8f} kcal/mol"
+    if 'batches' in summary:
+        line += f", {summary['batches']} batches"
+    line += "\n"
+    # representatives are written sorted by energy, as clusters are
+    for num, cluster in enumerate(summary.get('clusters', ())):
+        line += (
+            f"    cluster {num: >3}: {cluster['size']: >4} conformers, "
+            f"population {cluster['population']: >6.1%}\n"
+        )
+    return line
+
+
+def largest_first(blocks):
+    """Returns indices of molecules, given as texts in .mol format, sorted by
+    number of heavy atoms, starting with the largest molecule. Molecules that
+    cannot be loaded are put at the end."""
+    def size(block):
+        m = Chem.MolFromMolBlock(block, removeHs=False)
+        return -1 if m is None else m.GetNumHeavyAtoms()
+    sizes = [size(block) for block in blocks]
+    return sorted(range(len(blocks)), key=sizes.__getitem__, reverse=True)
+
+
+def _run_unordered(function, items, jobs, *args):
+    """Calls `function(*item, *args)` for each of `items` in a pool of `jobs`
+    processes and yields (item, result) tuples in order of completion.
+    At most twice as many items as processes are consumed in advance,
+    so `items` may be a lazy iterator."""
+    limit = 2 * (jobs or os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=jobs or None) as executor:
+        pending = {}
+        for item in items:
+            if len(pending) >= limit:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield pending.pop(future), future.result()
+            pending[executor.submit(function, *item, *args)] = item
+        for future in as_completed(pending):
+            yield pending[future], future.result()
+
+
 def main(argv=None):
     """Performs a conformaional search specified by args given. Run `python
     confsearch.py --help` for details on expected arguments."""
@@ -272,14 +2333,12 @@ def main(argv=None):
     lgg.info(f"Confsearch by Michał M. Więcław")
     
     if args.molecules is None:
-        mol_names = [name for name in os.listdir(args.directory)
-                     if name.endswith('.mol')]
-        molecules = [args.directory + '\\' + name for name in mol_names]
+        files = [os.path.join(args.directory, name)
+                 for name in sorted(os.listdir(args.directory))
+                 if name.endswith('.mol')]
     else:
-        molecules = args.molecules
-        mol_names = [mol.split('\\')[-1] for mol in molecules]
-    lgg.debug(f"molecules: {molecules}")
-    lgg.debug(f"molecules names: {mol_names}")
+        files = args.molecules
+    lgg.debug(f"molecules: {files}")
 
     if args.constraints:
         constraints = get_constraints(args.constraints)
@@ -287,68 +2346,120 @@ def main(argv=None):
         constraints = {}
     
     os.makedirs(args.output_dir, exist_ok=True)
-    report_file = args.output_dir + '\\' + \
-        'confsearch_report.txt'
-    with open(report_file, 'w') as report:
-        report.write(
-            f"Confsearch -- RMSD treshold   = {args.rms_tresh} Anstrom,\n"
-            f"              energy window   = {args.energy_window} kcal/mol,\n"
-            f"              confs requested = {args.num_confs}\n\n"
-        )
-        report.write(f"Energies values of most stable conformers:\n")
-        longest = max(map(len, mol_names))
-        for mol, name in zip(molecules, mol_names):
-            lgg.info(f"Starting with molecule {name}")
-            m = Chem.MolFromMolFile(mol, removeHs=False)
-            if m is not None:
-                lgg.info('Molecule loaded.')
-            else:
-                lgg.warning(f"Couldn't load molecule {name}")
-                continue
-                
-            atoms = {}
-            for atnum in (atom.GetAtomicNum() for atom in m.GetAtoms()):
-                atoms[atnum] = atoms.get(atnum, 0) + 1
-            lgg.debug(f"atoms in structure: {atoms}")
-            Chem.AssignStereochemistryFrom3D(m)
-            lgg.debug(f"Stereochemistry found: {Chem.FindMolChiralCenters(m)}")
-            
-            conf = m.GetConformer()
-            coord_map = {n-1: conf.GetAtomPosition(n-1) for n in args.fixed}
-            
-            m, cid, en, ens = find_lowest_energy_conformer(
-                m, args.num_confs, args.rms_tresh, args.max_cycles, coord_map,
-                constraints
-            )
-            num = m.GetNumConformers()
-            lgg.info(f"Number of conformers optimized: {num}")
-            m = energy_sieve(m, ens, args.energy_window)
-            lgg.info(
-                f"{num-m.GetNumConformers()} conformers outside energy window."
-            )
-            num = m.GetNumConformers()
-            m = rms_sieve(m, ens, args.rms_tresh)
-            lgg.info(
-                f"{num-m.GetNumConformers()} conformers discarded by "
-                "RMS sieve."
+    report_file = os.path.join(args.output_dir, 'confsearch_report.txt')
+    engine = select_engine(args.engine, args.fixed, constraints)
+    header = (
+        f"Confsearch -- RMSD treshold   = {args.rms_tresh} Anstrom,\n"
+        f"              energy window   = {args.energy_window} kcal/mol,\n"
+        f"              confs requested = {args.num_confs},\n"
+        f"              engine          = {engine},\n"
+        f"              force field     = {args.force_field},\n"
+        f"              random seed     = "
+        f"{'none' if args.seed is None else args.seed}\n\n"
+        f"Energies values of most stable conformers:\n"
+    )
+    molecules = enumerate(read_molecules(files))
+    if args.jobs != 1 and not any(map(is_sdf, files)):
+        molecules = list(molecules)
+        order = largest_first([block for _, (_, _, block, _) in molecules])
+        molecules = [molecules[n] for n in order]
+    names, summaries = {}, {}
+    with ExitStack() as stack:
+        # molecules from .sdf files are written to combined output files
+        mode = 'a' if args.resume else 'w'
+        combined = {
+            path: tuple(
+                stack.enter_context(open(os.path.join(
+                    args.output_dir, sdf_stem(path) + suffix
+                ), mode)) for suffix in ('_min_confs.sdf', '_confs.sdf')
+            ) for path in files if is_sdf(path) and not args.single_file
+        }
+        if args.single_file:
+            writer = stack.enter_context(CombinedWriter(
+                os.path.join(args.output_dir, 'confsearch_confs.sdf' + (
+                    '.gz' if args.gzip else ''
+                )), compress=args.gzip, append=args.resume
+            ))
+        else:
+            writer = None
+        report = stack.enter_context(open(report_file, 'w'))
+        stats_file = stack.enter_context(open(os.path.join(
+            args.output_dir, 'confsearch_stats.jsonl'
+        ), mode))
+        report.write(header)
+        report.flush()
+
+        def pending():
+            for num, (name, stem, block, source) in molecules:
+                names[num] = name
+                summary = load_done(checkpoint_path(args, stem)) \
+                    if args.resume else None
+                if summary is not None:
+                    lgg.info(f"Molecule {name} already done, skipping.")
+                    summaries[num] = summary
+                    continue
+                yield num, name, stem, block, source
+
+        if args.jobs == 1:
+            results = (
+                (item, _search_item(*item, args, constraints))
+                for item in pending()
             )
-            lgg.info(f"Number of conformers generated: {m.GetNumConformers()}")
-            molrepr = Chem.MolToMolBlock(m, confId=cid)
-            molfilename = mol.split('\\')[-1]
-            outfile = args.output_dir + '\\' + molfilename.split('.')[-2] \
-                + '_min_conf.mol'
-            with open(outfile, 'w') as file:
-                file.write(molrepr)
-            lgg.info(f"Lowest energy conformer saved to {outfile}")
-            report.write(
-                f"{name: <{longest}} = {en: > 13.8f} kcal/mol\n"
+        else:
+            results = _run_unordered(
+                _search_item, pending(), args.jobs, args, constraints
             )
-            sdfile = args.output_dir + '\\' + molfilename.split('.')[-2] \
-                + '_confs.sdf'
-            writer = Chem.SDWriter(sdfile)
-            for conf in m.GetConformers():
-                writer.write(m, confId=conf.GetId())
-            writer.close()
+        for (num, name, stem, block, source), result in results:
+            if result is None:
+                continue
+            summary, min_conf, confs = result
+            checkpoint = checkpoint_path(args, stem)
+            if writer is not None:
+                writer.write(
+                    name, confs, summary['conformers'],
+                    partial(mark_done, checkpoint, summary)
+                )
+            elif source in combined:
+                min_file, confs_file = combined[source]
+                min_file.write(min_conf)
+                confs_file.write(confs)
+                min_file.flush()
+                confs_file.flush()
+                mark_done(checkpoint, summary)
+            else:
+                outfile = os.path.join(args.output_dir, stem + '_min_conf.mol')
+                with open(outfile, 'w') as file:
+                    # strip properties and record separator
+                    file.write(min_conf[:min_conf.index('M  END\n') + 7])
+                lgg.info(f"Lowest energy conformer saved to {outfile}")
+                sdfile = os.path.join(args.output_dir, stem + '_confs.sdf')
+                with open(sdfile, 'w') as file:
+                    file.write(confs)
+                mark_done(checkpoint, summary)
+            summaries[num] = summary
+            report.write(report_line(name, summary, 0))
+            report.flush()
+            stats_file.write(json.dumps({
+                'molecule': name, 'energy': summary['energy'],
+                'conformers': summary['conformers'], **summary['stats']
+            }) + '\n')
+            stats_file.flush()
+    # all molecules finished, checkpoints are no longer needed
+    shutil.rmtree(
+        os.path.join(args.output_dir, 'checkpoints'), ignore_errors=True
+    )
+    if args.cache:
+        evict_cache(
+            os.path.join(args.output_dir, 'cache'), args.cache_size * 2 ** 20
+        )
+    # rewrite report, so molecules are listed in order they were given
+    longest = max(map(len, names.values()), default=0)
+    with open(report_file, 'w') as report:
+        report.write(header)
+        report.writelines(
+            report_line(names[num], summaries[num], longest)
+            for num in sorted(summaries)
+        )
     
     
 if __name__ == '__main__':
@@ -1,8 +1,11 @@
 import openpyxl as opxl
 from openpyxl.utils import column_index_from_string
+import json
+import os
 import re
 import argparse
-from itertools import chain
+from concurrent.futures import ThreadPoolExecutor
+from fnmatch import fnmatch
 from pathlib import Path
 import logging
 
@@ -24,6 +27,31 @@ energies = re.compile(
 imag = re.compile(
     r"\*\s+(\d+) imaginary frequencies \(negative Signs\)"
 )  # use match = imag.search(text); if match: match.group(1)
+low_frequencies = re.compile(r" Low frequencies ---")
+# same patterns for bytes read from file, accepting also windows line endings
+energies_bytes = re.compile(energies.pattern.replace(r'\n', r'\r?\n').encode())
+imag_bytes = re.compile(imag.pattern.encode())
+low_frequencies_bytes = re.compile(low_frequencies.pattern.encode())
+
+# patterns used by line-oriented parser of optimization progress
+scf_done = re.compile(r' SCF Done:\s+E\(\S+\)\s+=' + number_group)
+criterion = re.compile(
+    r' (Maximum|RMS)\s+(Force|Displacement)' + number_group + number_group
+    + r'\s+(YES|NO)'
+)
+orientation = re.compile(r'\s+(Standard|Input) orientation:')
+atom_line = re.compile(r'\s+\d+\s+(\d+)\s+-?\d+' + number_group * 3)
+
+ELEMENTS = (
+    "X H He Li Be B C N O F Ne Na Mg Al Si P S Cl Ar K Ca Sc Ti V Cr Mn Fe "
+    "Co Ni Cu Zn Ga Ge As Se Br Kr Rb Sr Y Zr Nb Mo Tc Ru Rh Pd Ag Cd In Sn "
+    "Sb Te I Xe Cs Ba La Ce Pr Nd Pm Sm Eu Gd Tb Dy Ho Er Tm Yb Lu Hf Ta W "
+    "Re Os Ir Pt Au Hg Tl Pb Bi Po At Rn Fr Ra Ac Th Pa U Np Pu Am Cm Bk Cf "
+    "Es Fm Md No Lr Rf Db Sg Bh Hs Mt Ds Rg Cn Nh Fl Mc Lv Ts Og"
+).split()  # indexed by atomic number
+
+CHUNK_SIZE = 2 ** 18  # 256 KB
+OVERLAP = 2 ** 12  # more than length of the longest searched pattern
 
 
 def get_args(argv=None):
@@ -58,10 +86,62 @@ def get_args(argv=None):
              'column COL. Column letter or 1-based numerical index may be '
              'given.'
     )
+    prs.add_argument(
+        '--scf', action='store_true',
+        help='Include the last SCF energy in the output.'
+    )
+    prs.add_argument(
+        '--steps', action='store_true',
+        help='Include number of optimization steps done and whether the last '
+             'one met convergence criteria in the output; energy and '
+             'criteria of each step are printed with --debug.'
+    )
+    prs.add_argument(
+        '--termination', action='store_true',
+        help='Include information whether calculation terminated normally in '
+             'the output.'
+    )
+    prs.add_argument(
+        '--geometry', type=Path, default=None, metavar='DIR',
+        help='Write the last geometry found in each file to xyz file in '
+             'given directory.'
+    )
     prs.add_argument(
         '-u', '--unconverged', action='store_true',
         help='Print names of files that did not converged.'
     )
+    prs.add_argument(
+        '-r', '--recursive', action='store_true',
+        help='Search given directories recursively. Files found in '
+             'subdirectories are reported with their path relative to '
+             'the directory given.'
+    )
+    prs.add_argument(
+        '--include', nargs='+', default=['*.log', '*.out'], metavar='PATTERN',
+        help='Glob patterns of names of files to process, '
+             'defaults to "*.log" and "*.out".'
+    )
+    prs.add_argument(
+        '--exclude', nargs='+', default=[], metavar='PATTERN',
+        help='Glob patterns of names of files and directories to skip.'
+    )
+    prs.add_argument(
+        '-L', '--follow_symlinks', action='store_true',
+        help='Follow symbolic links to directories when searching '
+             'recursively.'
+    )
+    prs.add_argument(
+        '-C', '--cache', type=Path, default=None, metavar='FILE',
+        help='Use given JSON file as a cache of parsed data: files, which '
+             'size and modification time did not change since previous run, '
+             'are not parsed again. File is created if it does not exist.'
+    )
+    prs.add_argument(
+        '-j', '--jobs', type=int, default=1,
+        help='Number of threads used to parse files concurrently, files are '
+             'reported in the same order regardless of this value. If 0 is '
+             'given, number of threads is chosen automatically. Defaults to 1.'
+    )
     log = prs.add_mutually_exclusive_group()
     log.add_argument(
         '-s', '--silent', action='store_const', const=logging.WARNING, dest="loglevel",
@@ -78,19 +158,283 @@ def get_args(argv=None):
     return args
 
 
-def get_data(path):
-    with path.open('r') as file:
-        text = file.read()
+def search_backward(file, pattern, end, start=0, chunk_size=CHUNK_SIZE):
+    """Finds the last match of bytes `pattern` in binary `file` between
+    `start` and `end` offsets, reading file backward in chunks of
+    `chunk_size` bytes, so only the end of the file is read if match is
+    near it. Matches must be shorter than OVERLAP bytes.
+
+    Returns
+    -------
+    tuple of (re.Match, int) or None
+        match found and offset of the text it was matched in, so
+        offset + match.start() is the position of match in the file;
+        None if there is no match."""
+    pos = end
+    while pos > start:
+        offset = max(start, pos - chunk_size)
+        file.seek(offset)
+        data = file.read(min(end, pos + OVERLAP) - offset)
+        match = None
+        for match in pattern.finditer(data):
+            pass
+        if match is not None:
+            return match, offset
+        pos = offset
+    return None
+
+
+def get_data(path, chunk_size=CHUNK_SIZE):
+    """Extracts thermochemistry data and number of imaginary frequencies
+    from gaussian output file. File is read backward from its end, so
+    usually only its last part, containing thermochemistry block of the
+    last frequency calculation, is read; whole file is scanned only if
+    there is no such block.
+
+    Returns
+    -------
+    list
+        eight thermochemistry values as strings, as they appear in file,
+        followed by number of imaginary frequencies; empty list if
+        thermochemistry block was not found."""
     logger.debug("Parsing file %s", path.name)
-    ens = energies.search(text)
-    freqs = imag.search(text)
-    freqs = freqs.group(1) if freqs else 0
+    with path.open('rb') as file:
+        size = file.seek(0, os.SEEK_END)
+        found = search_backward(file, energies_bytes, size, 0, chunk_size)
+        ens, freqs = None, 0
+        if found:
+            ens, offset = found
+            end = offset + ens.start()
+            # imaginary frequencies are reported right after low frequencies
+            low = search_backward(
+                file, low_frequencies_bytes, end, 0, chunk_size
+            )
+            start = low[1] + low[0].start() if low else 0
+            match = search_backward(file, imag_bytes, end, start, chunk_size)
+            freqs = match[0].group(1).decode() if match else 0
     if not ens:
         logger.debug("NOT CONVERGED: %s (no energies found).", path.name)
         return []
     else:
         logger.debug("imag.freqs = %s found in %s", freqs, path.name)
-        return [*ens.groups(), freqs]
+        return [*(group.decode() for group in ens.groups()), freqs]
+
+
+def get_progress(path):
+    """Extracts progress of calculation from gaussian output file. File is
+    read line by line in a single pass and never held in memory as a whole,
+    so this is suitable also for huge outputs of running calculations.
+
+    Returns
+    -------
+    dict
+        with keys:
+        'scf': the last SCF energy as float or None, if not found;
+        'steps': list of optimization steps, each being a dict with keys
+        'energy' (the last SCF energy before step's convergence table),
+        'criteria' (dict of criterion name, e.g. "Maximum Force", to a list
+        of value, threshold and whether it is met) and 'converged' (True if
+        all criteria are met);
+        'geometry': the last geometry (standard or input orientation) as
+        a list of [atomic number, x, y, z] lists, or None, if not found;
+        'normal_termination': True if the last job terminated normally."""
+    logger.debug("Reading progress of %s", path.name)
+    scf, steps, geometry, normal = None, [], None, False
+    atoms, separators, criteria = None, 0, None
+    with path.open('r', errors='replace') as file:
+        for line in file:
+            if atoms is not None:
+                # inside of orientation table, which is enclosed by dashes
+                if line.startswith(' ---'):
+                    separators += 1
+                    if separators == 3:
+                        geometry, atoms = atoms, None
+                elif separators == 2:
+                    match = atom_line.match(line)
+                    if match:
+                        num, *xyz = match.groups()
+                        atoms.append([int(num), *map(float, xyz)])
+            elif line.startswith(' SCF Done:'):
+                match = scf_done.match(line)
+                if match:
+                    scf = float(match.group(1))
+            elif line.startswith((' Maximum ', ' RMS ')):
+                match = criterion.match(line)
+                if not match:
+                    continue
+                kind, item, value, threshold, met = match.groups()
+                if criteria is None or (kind, item) == ('Maximum', 'Force'):
+                    # first item of convergence table starts new step
+                    criteria = {}
+                    steps.append({'energy': scf, 'criteria': criteria})
+                criteria[f"{kind} {item}"] = [
+                    float(value), float(threshold), met == 'YES'
+                ]
+            elif 'orientation:' in line and orientation.match(line):
+                atoms, separators = [], 0
+            elif line.startswith(' Normal termination'):
+                normal = True
+            elif line.startswith(' Entering Link 1 '):
+                # new job started
+                normal, criteria = False, None
+    for step in steps:
+        step['converged'] = all(c[2] for c in step['criteria'].values())
+    return {
+        'scf': scf, 'steps': steps, 'geometry': geometry,
+        'normal_termination': normal
+    }
+
+
+def write_xyz(path, geometry, comment=''):
+    """Writes `geometry`, as returned by `get_progress`, to xyz file."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open('w') as file:
+        file.write(f"{len(geometry)}\n{comment}\n")
+        for num, x, y, z in geometry:
+            file.write(f"{ELEMENTS[num]: <2} {x: >12.6f} {y: >12.6f} "
+                       f"{z: >12.6f}\n")
+
+
+def load_cache(path):
+    """Returns cache of parsed data stored in JSON file at `path`
+    or empty dict, if there is no valid cache file."""
+    try:
+        with path.open('r') as file:
+            cache = json.load(file)
+    except (OSError, ValueError):
+        return {}
+    return cache if isinstance(cache, dict) else {}
+
+
+def save_cache(path, cache, seen=None):
+    """Writes `cache` to JSON file at `path`, replacing it atomically.
+    If `seen` set of cache keys is given, other entries, e.g. of files
+    deleted or moved since they were cached, are not written."""
+    if seen is not None:
+        cache = {key: entry for key, entry in cache.items() if key in seen}
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    with tmp.open('w') as file:
+        json.dump(cache, file)
+    os.replace(tmp, path)
+
+
+def get_cached_data(path, cache, progress=False, seen=None):
+    """Returns tuple of data of file at `path`, as `get_data` returns it,
+    and its progress, as `get_progress` returns it, if `progress` is True,
+    otherwise None. Values are taken from `cache` dict if file's size and
+    modification time did not change since they were cached; otherwise file
+    is parsed and its data is cached. If `seen` set is given, cache key
+    of the file is added to it."""
+    stat = path.stat()
+    key = str(path.resolve())
+    if seen is not None:
+        seen.add(key)
+    entry = cache.get(key)
+    if not entry or entry['size'] != stat.st_size \
+            or entry['mtime'] != stat.st_mtime_ns:
+        entry = cache[key] = {
+            'size': stat.st_size, 'mtime': stat.st_mtime_ns,
+            'data': get_data(path)
+        }
+    else:
+        logger.debug("Using cached data of %s", path.name)
+    if progress and 'progress' not in entry:
+        entry['progress'] = get_progress(path)
+    return entry['data'], entry.get('progress') if progress else None
+
+
+def _matches(name, include, exclude):
+    """Tells if `name` matches any of `include` and none of `exclude`
+    glob patterns."""
+    return any(fnmatch(name, pattern) for pattern in include) \
+        and not any(fnmatch(name, pattern) for pattern in exclude)
+
+
+def _scan(directory, prefix, include, exclude, recursive, follow_symlinks,
+          visited):
+    """Yields (name, path) tuples of matching files in `directory`, sorted
+    by name, descending into subdirectories if `recursive` is True. Types of
+    entries are taken from os.scandir, so usually no additional stat calls
+    are needed. `visited` is a set of (device, inode) of directories already
+    searched, used to avoid symlink loops."""
+    try:
+        with os.scandir(directory) as entries:
+            entries = sorted(entries, key=lambda entry: entry.name)
+    except OSError as error:
+        logger.warning("Cannot search directory %s: %s", directory, error)
+        return
+    for entry in entries:
+        if any(fnmatch(entry.name, pattern) for pattern in exclude):
+            continue
+        name = prefix + entry.name
+        if entry.is_dir(follow_symlinks=follow_symlinks):
+            if not recursive:
+                continue
+            if follow_symlinks:
+                # DirEntry.stat() does not provide inode numbers on windows
+                stat = os.stat(entry.path)
+                if (stat.st_dev, stat.st_ino) in visited:
+                    continue
+                visited.add((stat.st_dev, stat.st_ino))
+            yield from _scan(
+                entry.path, name + '/', include, exclude, recursive,
+                follow_symlinks, visited
+            )
+        elif entry.is_file() and _matches(entry.name, include, ()):
+            yield name, Path(entry.path)
+
+
+def find_files(
+        paths, include=('*.log', '*.out'), exclude=(), recursive=False,
+        follow_symlinks=False
+):
+    """Yields (name, path) tuples of files to process: first of files given
+    in `paths`, then of files found in directories given in `paths`.
+    Only files which names match any of `include` glob patterns and none
+    of `exclude` patterns are yielded. Files in directories are yielded
+    sorted by name; if `recursive` is True, subdirectories are searched too
+    (excluding those matching `exclude` patterns) and name of each file
+    found is its path relative to the directory given. Symbolic links to
+    directories are followed only if `follow_symlinks` is True."""
+    for path in paths:
+        if path.is_file() and _matches(path.name, include, exclude):
+            yield path.name, path
+    visited = set()
+    for path in paths:
+        if path.is_dir():
+            if follow_symlinks:
+                stat = path.stat()
+                visited.add((stat.st_dev, stat.st_ino))
+            yield from _scan(
+                path, '', include, exclude, recursive, follow_symlinks,
+                visited
+            )
+
+
+def parse_files(files, jobs=1, cache=None, progress=False, seen=None):
+    """Yields tuples of (name, data, progress) for each (name, path) tuple
+    in `files`, as yielded by `find_files`, where data is as returned by
+    `get_data` and progress is as returned by `get_progress`, if `progress`
+    is True, otherwise None, in order of `files`. If `jobs` is
+    other than 1, files are parsed concurrently by a pool of `jobs` threads
+    (or default number of threads, if `jobs` is 0). If `cache` dict is given,
+    unchanged files are not parsed again and cache keys of files parsed
+    are added to `seen` set, if it is given, see `get_cached_data`."""
+    if cache is None:
+        def parse(path):
+            return get_data(path), get_progress(path) if progress else None
+    else:
+        def parse(path):
+            return get_cached_data(path, cache, progress, seen)
+    if jobs == 1:
+        for name, path in files:
+            yield (name, *parse(path))
+        return
+    files = list(files)
+    with ThreadPoolExecutor(max_workers=jobs or None) as executor:
+        results = executor.map(parse, (path for _, path in files))
+        for name, result in zip((name for name, _ in files), results):
+            yield (name, *result)
 
 
 def select_data(line, args):
@@ -115,21 +459,49 @@ def select_data(line, args):
     return entries
 
 
+def select_progress(progress, args):
+    if progress is None:
+        return []
+    entries = []
+    # entry: name, value
+    if args.scf:
+        entries.append(("SCF", progress['scf']))
+    if args.steps:
+        steps = progress['steps']
+        entries.append(("Steps", len(steps)))
+        entries.append(
+            ("Opt.Conv", 'YES' if steps and steps[-1]['converged'] else 'NO')
+        )
+    if args.termination:
+        entries.append(
+            ("Normal.Term", 'YES' if progress['normal_termination'] else 'NO')
+        )
+    return entries
+
+
+def log_steps(file, progress):
+    for num, step in enumerate(progress['steps'], start=1):
+        logger.debug(
+            ' '.join((
+                f"{file} - step {num}: E= {step['energy']}",
+                *(f"{name}= {value} ({'YES' if met else 'NO'})"
+                  for name, (value, _, met) in step['criteria'].items())
+            ))
+        )
+
+
 def main(argv=None):
     args = get_args(argv)
     logging.basicConfig(level=args.loglevel)
-    dirs = (path for path in args.files if path.is_dir())
-    inner_files = (
-        path for dir in dirs for path in dir.iterdir()
-        if path.is_file() and path.suffix in ['.log', '.out']
-    )
-    args_files = (
-        path for path in args.files
-        if path.is_file() and path.suffix in ['.log', '.out']
-    )
-    files = chain(args_files, inner_files)
-    lines = ((path.name, get_data(path)) for path in files)
-    data = ((file, select_data(line, args)) for file, line in lines)
+    files = find_files(
+        args.files, args.include, args.exclude, args.recursive,
+        args.follow_symlinks
+    )
+    cache = load_cache(args.cache) if args.cache else None
+    progress = args.scf or args.steps or args.termination or \
+        args.geometry is not None
+    seen = set()
+    lines = parse_files(files, args.jobs, cache, progress, seen)
     if args.file:
         wb = opxl.load_workbook(str(args.file))
         sheet = wb.active
@@ -143,10 +515,29 @@ def main(argv=None):
             args.append_entry = int(args.append_entry)
         except ValueError:
             args.append_entry = column_index_from_string(args.append_entry)
-    for file, (converged, *entries) in data:
+    for file, line, prog in lines:
+        converged, *entries = select_data(line, args)
+        progress_entries = select_progress(prog, args)
+        if prog is not None:
+            log_steps(file, prog)
+            if args.geometry is not None and prog['geometry']:
+                write_xyz(
+                    args.geometry / f"{file.rsplit('.', 1)[0]}.xyz",
+                    prog['geometry'], file
+                )
         if not converged:  # no data extracted
             unconverged.append(file)
+            if progress_entries:
+                # report progress of calculation that is not finished
+                length = len(file) if len(file) > length else length
+                logger.info(
+                    ' '.join((
+                        f"{file: <{length}} -",
+                        *("{}= {}".format(*e) for e in progress_entries)
+                    ))
+                )
             continue
+        entries += progress_entries
         if not entries:
             # only unconverged requested
             continue
@@ -171,6 +562,8 @@ def main(argv=None):
                 file, '',  # place for comment on this file
                 *(e[1] for e in entries)
             ])
+    if cache is not None:
+        save_cache(args.cache, cache, seen)
     if args.unconverged:
         logger.info(f"{len(unconverged)} unconverged files:")
         for filename in unconverged: